@@ -9,6 +9,8 @@ Created on Jan 16, 2013
 '''
 
 from .common_base import (
+    clear_load_cache,
+    load_many_settings,
     preferred_file,
 )
 
@@ -41,6 +43,7 @@ __all__ = [
     'JSONSettings',
     'TOMLSettings',
     'YAMLSettings',
+    'clear_load_cache',
     'esCompareError',
     'esError',
     'esGetError',
@@ -48,6 +51,7 @@ __all__ = [
     'esSetError',
     'esValueError',
     'load_json_settings',
+    'load_many_settings',
     'load_toml_settings',
     'load_yaml_settings',
     'preferred_file',
@@ -5,10 +5,14 @@
     -Christopher Welborn 05-07-2019
 """
 
+import copy
 import os
 import pathlib
+import pickle
 import shutil
+import threading
 from collections import UserDict
+from concurrent.futures import ThreadPoolExecutor
 
 
 class _NotSet(object):
@@ -24,6 +28,29 @@ class _NotSet(object):
 NotSet = _NotSet()
 
 
+# Decoded file data, by settings class, file path, mtime, size, and load
+# arguments. See SettingsBase._read_cached().
+LOAD_CACHE_SIZE = 32
+# Values that never need to be copied when handing out cached data.
+LOAD_CACHE_TYPES = frozenset((bool, float, int, str, type(None)))
+_load_cache = {}
+_load_cache_lock = threading.Lock()
+
+
+def clear_load_cache():
+    """ Forget all decoded file data cached by SettingsBase.load(). """
+    with _load_cache_lock:
+        _load_cache.clear()
+
+
+def _defined_in(cls, name):
+    """ Returns the class in the MRO of `cls` that defines `name`. """
+    for base in cls.__mro__:
+        if name in base.__dict__:
+            return base
+    return None
+
+
 def preferred_file(filenames):
     """ Returns the first existing file name. If a `str` is given, only it
         will be tried.
@@ -92,8 +119,12 @@ def load_settings(cls, filename, default=None, **kwargs):
         config = cls.from_file(filename, **kwargs)
         # Set any defaults passed in, if not already set.
         # load_hook is used so that subclasses keep their custom behavior.
-        for k, v in config.load_hook(defaults).items():
-            config.setdefault(k, v)
+        defaults_loaded = config.load_hook(defaults)
+        if not (defaults_loaded.keys() <= config.data.keys()):
+            # Some are missing. Merge them in one go, existing keys win.
+            merged = dict(defaults_loaded)
+            merged.update(config.data)
+            config.data = merged
         config.set_defaults(defaults)
     except FileNotFoundError:
         # New config, no file yet.
@@ -101,8 +132,73 @@ def load_settings(cls, filename, default=None, **kwargs):
     return config
 
 
+def load_many_settings(
+        cls, filenames, default=None, max_workers=None, **kwargs):
+    """ Like load_settings(), but loads several files at once, using a
+        thread pool so that file reads can overlap.
+
+        Returns a list of instantiated classes, in the same order as
+        `filenames`.
+
+        Arguments:
+            cls          : The class instance to create.
+            filenames    : File paths to load, or try to load.
+                           Each item may be anything load_settings() accepts.
+            default      : Default dict for config keys/values.
+            max_workers  : Maximum number of threads to use.
+                           Default: min(32, len(filenames))
+            **kwargs     : Extra arguments for load_settings().
+    """
+    filenames = list(filenames)
+    if not filenames:
+        return []
+
+    def load(filename):
+        return load_settings(cls, filename, default=default, **kwargs)
+
+    max_workers = max_workers or min(32, len(filenames))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(load, filenames))
+
+
+def fsync_dir(filename):
+    """ Flush the directory entry for `filename` to disk, so a new or renamed
+        file survives a crash. Does nothing where directories can't be
+        opened (Windows).
+    """
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(os.path.dirname(filename) or '.', os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_replace(filename, data, mode='wb', durable=False):
+    """ Write all of `data` to a temporary file next to `filename`, and then
+        replace `filename` with it. Readers will see the old file or the new
+        one, never a partially written file.
+        See ReplacingWriter for the details.
+    """
+    with ReplacingWriter(filename, mode=mode, durable=durable) as f:
+        f.write(data)
+
+
 class SettingsBase(UserDict):
     """ Base class for all *Settings classes. Holds shared methods. """
+    # Whether decoded files with nested values are cached by load().
+    # They have to be deep-copied, which can be slower than a fast decoder.
+    cache_nested = True
+    # Whether a pickled copy of decoded files is kept next to them.
+    # See _read_sidecar().
+    sidecar = False
+    # Whether save() flushes files to disk (fsync), to survive crashes.
+    durable = False
+    # What was last loaded/saved, while self.data still matches the file.
+    # See _mark_saved().
+    _saved = None
+
     def __init__(
             self, iterable=None, filename=None, load_kwargs=None, **kwargs):
         """ Initialize a SettingsBase instance like a `dict`, with optional
@@ -110,10 +206,13 @@ class SettingsBase(UserDict):
             but can be set with those methods at the time).
         """
         if iterable:
-            self.data = dict(iterable)
+            if type(iterable) is dict:
+                self.data = iterable.copy()
+            else:
+                self.data = dict(iterable)
         elif kwargs:
-            # dict() behaves like this.
-            self.data = self.load_hook({k: v for k, v in kwargs.items()})
+            # dict() behaves like this. `kwargs` is always a new dict.
+            self.data = self.load_hook(kwargs)
         else:
             self.data = {}
         self.filename = preferred_file(filename or None)
@@ -149,10 +248,35 @@ class SettingsBase(UserDict):
             else:
                 # A config key, not a real attribute.
                 if key in data:
-                    data[key] = value
+                    self[key] = value
                     return
         object.__setattr__(self, key, value)
 
+    def __delitem__(self, key):
+        del self.data[key]
+        self.__dict__['_saved'] = None
+
+    def __getitem__(self, key):
+        """ Like UserDict.__getitem__, with one dict lookup for existing keys
+            instead of two.
+        """
+        try:
+            return self.data[key]
+        except KeyError:
+            pass
+        if hasattr(type(self), '__missing__'):
+            return self.__missing__(key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        data = self.data
+        if self._saved is not None:
+            old = data.get(key, NotSet)
+            if (type(old) is not type(value)) or (
+                    type(value) not in LOAD_CACHE_TYPES) or (old != value):
+                self.__dict__['_saved'] = None
+        data[key] = value
+
     def add_file(self, filename, optional=True, **kwargs):
         """ Merges another config file, overwriting any existing key values.
             If `optional` is False, a FileNotFoundError is raised for mising
@@ -177,16 +301,22 @@ class SettingsBase(UserDict):
         """ Like `dict.get`. Raises `KeyError` for missing keys if no
             default value is given.
         """
-        val = self.data.get(option, NotSet)
-        if val is NotSet:
+        try:
+            # Existing keys are the common case, and the fastest path.
+            return self.data[option]
+        except KeyError:
             if default is NotSet:
                 raise KeyError('Key does not exist: {}'.format(option))
             return default
-        return val
 
     def load(self, module, filename=None, **kwargs):
         """ Load this dict from a file using `module`.load(f, **args).
             Raises the same errors as open() and `module`.load().
+            Decoded data is cached by file path, modification time, and size,
+            so unchanged files aren't decoded again.
+            Pass `use_cache=False` to always read the file.
+            Pass `sidecar=True` to keep a pickled copy of the decoded data
+            next to the file, for faster loading later (see _read_sidecar()).
         """
         if filename or (not getattr(self, 'filename', None)):
             self.filename = filename
@@ -194,35 +324,253 @@ class SettingsBase(UserDict):
         if not self.filename:
             raise ValueError('`filename` must be set.')
 
-        extra_args = self.load_kwargs
-        extra_args.update(kwargs)
+        self.load_kwargs.update(kwargs)
+        extra_args = dict(self.load_kwargs)
+        use_cache = extra_args.pop('use_cache', True)
+        sidecar = extra_args.pop('sidecar', None)
+        if sidecar is not None:
+            self.sidecar = sidecar
+        # Only a fresh instance will match the file after loading.
+        fresh = not self.data
+        if use_cache:
+            data = self._read_cached(module, **extra_args)
+        else:
+            data = self._read_source(module, **extra_args)
+        self._update_loaded(data)
+        if fresh:
+            self._mark_saved()
+        else:
+            self.__dict__['_saved'] = None
+
+    def _is_saved(self, kwargs=None):
+        """ Returns True if self.data hasn't changed since it was loaded
+            from, or saved to, self.filename (with the same save() `kwargs`,
+            if given), and the file hasn't changed either.
+            self.data is compared to a copy made by _mark_saved(), so changes
+            made directly to self.data are seen too. Values that can be
+            changed in place (lists, dicts) are never considered saved.
+        """
+        saved = self._saved
+        if saved is None:
+            return False
+        filename, snapshot, stamp, saved_kwargs = saved
+        if filename != self.filename:
+            return False
+        if (kwargs is not None) and (saved_kwargs is not None) and (
+                saved_kwargs != kwargs):
+            return False
+        data = self.data
+        if len(data) != len(snapshot):
+            return False
+        for key, value in snapshot.items():
+            current = data.get(key, NotSet)
+            if (type(current) is not type(value)) or (
+                    type(value) not in LOAD_CACHE_TYPES) or (
+                    current != value):
+                return False
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return False
+        return stamp == (st.st_mtime_ns, st.st_size)
+
+    def _mark_saved(self, kwargs=None):
+        """ Remember that self.data matches self.filename, because it was
+            just loaded or saved (with `kwargs`, or None for any kwargs).
+            See _is_saved().
+        """
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            saved = None
+        else:
+            saved = (
+                self.filename,
+                dict(self.data),
+                (st.st_mtime_ns, st.st_size),
+                kwargs,
+            )
+        self.__dict__['_saved'] = saved
+
+    def _append_item(self, option, value, filename=None, kwargs=None):
+        """ Add a new top-level `option` to self.filename by appending it,
+            instead of saving the whole file again. This only works when the
+            file is a flat mapping that matches self.data (see _is_saved()),
+            and the subclass can encode single items (see _dump_items()).
+            It is never used for durable saves, because an interrupted append
+            is not rolled back, or when a subclass overrides set() or
+            save(), because they would be skipped.
+            Save `kwargs` must match the ones the file was last saved with.
+            Returns True if the option was set and appended.
+        """
+        if self.durable or (filename and (filename != self.filename)):
+            return False
+        cls = type(self)
+        mro = cls.__mro__
+        if (cls.set is not SettingsBase.set) or (
+                cls.__setitem__ is not SettingsBase.__setitem__) or (
+                mro.index(_defined_in(cls, 'save')) <
+                mro.index(_defined_in(cls, '_dump_items'))):
+            return False
+        if (option in self.data) or (type(value) not in LOAD_CACHE_TYPES):
+            return False
+        if not self._is_saved():
+            return False
+        if kwargs:
+            saved_kwargs = self._saved[3] or {}
+            if any(
+                    saved_kwargs.get(k, NotSet) != v
+                    for k, v in kwargs.items()):
+                # The file would be saved differently (sort_keys, indent).
+                return False
+        items = self.save_hook({option: value})
+        if not all(type(v) in LOAD_CACHE_TYPES for v in items.values()):
+            return False
+        payload = self._dump_items(items)
+        if not payload:
+            return False
+        with open(self.filename, 'r+b') as f:
+            if f.seek(0, os.SEEK_END):
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    payload = b'\n' + payload
+            f.write(payload)
+        self.data[option] = value
+        self._mark_saved(self._saved[3])
+        return True
+
+    def _dump_items(self, items):
+        """ Encode `items`, a dict of new top-level keys with scalar values,
+            as bytes that can be appended to a file saved with self.data.
+            Returns None when that isn't possible, which is always the case
+            here. Subclasses for line-based formats can override this.
+        """
+        return None
+
+    def _read_source(self, module, **kwargs):
+        """ Read and decode self.filename, through the sidecar file if
+            self.sidecar is set.
+        """
+        if self.sidecar:
+            return self._read_sidecar(module, **kwargs)
+        return self._read_file(module, **kwargs)
+
+    def _read_cached(self, module, **kwargs):
+        """ Like _read_file(), but reuses the decoded data when the same file
+            was already loaded, and hasn't changed since then.
+        """
+        try:
+            st = os.stat(self.filename)
+            key = (
+                type(self),
+                os.path.abspath(self.filename),
+                st.st_mtime_ns,
+                st.st_size,
+                tuple(sorted(kwargs.items())),
+            )
+            cached = _load_cache.get(key, None)
+        except (OSError, TypeError):
+            # Missing file (_read_file() will raise), or unhashable args.
+            return self._read_source(module, **kwargs)
+        if cached is not None:
+            return self._copy_cached(cached)
+
+        data = self._read_source(module, **kwargs)
+        if type(data) is dict:
+            flat = all(type(v) in LOAD_CACHE_TYPES for v in data.values())
+            if flat or self.cache_nested:
+                with _load_cache_lock:
+                    if len(_load_cache) >= LOAD_CACHE_SIZE:
+                        # Forget the oldest entry.
+                        del _load_cache[next(iter(_load_cache))]
+                    _load_cache[key] = self._copy_cached(data)
+        return data
+
+    def _copy_cached(self, data):
+        """ Copy cached data, so instances never share values. """
+        if all(type(v) in LOAD_CACHE_TYPES for v in data.values()):
+            return data.copy()
+        return copy.deepcopy(data)
+
+    def _read_file(self, module, **kwargs):
+        """ Read and decode self.filename using `module`.load(f, **kwargs).
+            Subclasses can override this to use a faster decoder.
+        """
         with open(self.filename, 'r') as f:
-            data = module.load(f, **extra_args)
+            return module.load(f, **kwargs)
+
+    def _read_sidecar(self, module, **kwargs):
+        """ Like _read_file(), but keeps a pickled copy of the decoded data
+            next to the file ('<filename>.cache'), and loads that instead
+            while the file is unchanged. Unpickling is much faster than
+            parsing YAML or TOML.
+            The sidecar is trusted like the file itself, so it should only
+            be used where nobody else can write next to the file.
+        """
+        st = os.stat(self.filename)
+        stamp = (st.st_mtime_ns, st.st_size)
+        sidecar = '{}.cache'.format(self.filename)
+        try:
+            with open(sidecar, 'rb') as f:
+                sidecar_stamp, data = pickle.load(f)
+        except Exception:
+            # Missing, unreadable, or corrupt sidecar. It will be replaced.
+            pass
+        else:
+            if sidecar_stamp == stamp:
+                return data
 
-        if data is None:
-            # Null/Empty.
-            data = {}
+        data = self._read_file(module, **kwargs)
+        try:
+            write_replace(
+                sidecar,
+                pickle.dumps((stamp, data), protocol=pickle.HIGHEST_PROTOCOL),
+            )
+        except (OSError, pickle.PicklingError, AttributeError, TypeError):
+            # Read-only directory, or data that can't be pickled.
+            pass
+        return data
 
-        if not isinstance(data, dict):
-            raise TypeError(
-                'Data was replaced with non dict type, got: {}'.format(
-                    type(data).__name__,
+    def _update_loaded(self, data):
+        """ Update self.data with freshly decoded `data` from a file,
+            after passing it through self.load_hook().
+        """
+        # Decoders almost always return a plain dict, so that is the only
+        # check on the common path.
+        if type(data) is not dict:
+            if data is None:
+                # Null/Empty.
+                data = {}
+            elif not isinstance(data, dict):
+                # Custom decoders (or toml's `_dict`) may use a dict subclass.
+                raise TypeError(
+                    'Data was replaced with non dict type, got: {}'.format(
+                        type(data).__name__,
+                    )
                 )
-            )
         # Replace existing values from __init__, add new ones.
         self.data.update(self.load_hook(data))
 
+    def _write_file(self, module, data, **kwargs):
+        """ Encode and write `data` to self.filename using
+            `module`.dump(data, f, **kwargs).
+            Subclasses can override this to use a faster encoder.
+        """
+        with BackedUpWriter(self.filename, durable=self.durable) as f:
+            module.dump(data, f, **kwargs)
+
     def load_hook(self, data):
         """ Called on self.data after JSON decoding, before setting
             self.data.
             Can be overridden to modify self.data after decoding, before
             before setting self.data.
         """
-        modified = {}
-        for k, v in data.items():
-            newk, newv = self.load_item_hook(k, v)
-            modified[newk] = newv
-        return modified
+        if (not data) or (
+                type(self).load_item_hook is SettingsBase.load_item_hook):
+            # Empty, or no item hook. Nothing would be modified.
+            return data
+        hook = self.load_item_hook
+        return dict(hook(k, v) for k, v in data.items())
 
     def load_item_hook(self, key, value):
         """ Called on all keys/values after JSON decoding, before setting
@@ -246,9 +594,11 @@ class SettingsBase(UserDict):
             self[k] = v
         return self
 
-    def save(self, module, filename=None, **kwargs):
+    def save(self, module, filename=None, force=False, **kwargs):
         """ Save this dict to a file using `module`.dump(**kwargs).
             Raises the same errors as open() and `module`.dump().
+            Nothing is written if nothing changed since the file was loaded
+            or saved (see _is_saved()), unless `force` is True.
         """
         filename = filename or getattr(self, 'filename', None)
         self.filename = filename
@@ -256,18 +606,21 @@ class SettingsBase(UserDict):
         if not self.filename:
             raise ValueError('`filename` must be set.')
 
-        with BackedUpWriter(self.filename) as f:
-            module.dump(self.save_hook(self.data), f, **kwargs)
+        if (not force) and self._is_saved(kwargs):
+            return
+        self._write_file(module, self.save_hook(self.data), **kwargs)
+        self._mark_saved(kwargs)
 
     def save_hook(self, data):
         """ Called on self.data before JSON encoding, before saving.
             Can be overridden to modify self.data before encoding/saving.
         """
-        modified = {}
-        for k, v in data.items():
-            newk, newv = self.save_item_hook(k, v)
-            modified[newk] = newv
-        return modified
+        if (not data) or (
+                type(self).save_item_hook is SettingsBase.save_item_hook):
+            # Empty, or no item hook. Nothing would be modified.
+            return data
+        hook = self.save_item_hook
+        return dict(hook(k, v) for k, v in data.items())
 
     def save_item_hook(self, key, value):
         """ Called on all keys/values before JSON encoding and saving.
@@ -282,7 +635,7 @@ class SettingsBase(UserDict):
                 option  : Option/key to set.
                 value   : Value to set for the option/key.
         """
-        self.data[option] = value
+        self[option] = value
 
     def set_defaults(self, default_config):
         """ Save a copy of keys/value-types from `default_config` to optionally
@@ -294,11 +647,104 @@ class SettingsBase(UserDict):
         }
 
     def setsave(self, option, value, filename=None, **kwargs):
-        """ The same as calling .set() and then .save(**kwargs). """
+        """ The same as calling .set() and then .save(**kwargs).
+            New keys may be appended to the file instead of saving all of it
+            (see _append_item()).
+        """
+        if self._append_item(
+                option, value, filename=filename, kwargs=kwargs):
+            return
         self.set(option, value)
         self.save(filename=filename, **kwargs)
 
 
+class ReplacingWriter(object):
+    """ A context manager that opens a new temporary file next to
+        `filename` for writing, and replaces `filename` with it when no
+        errors occur. Readers will see the old file or the new one, never a
+        partially written file.
+        If errors do occur, the temporary file is removed, and `filename` is
+        left alone.
+
+        Symlinks are followed, so the file they point to is replaced.
+        An existing file's permissions are kept, new files get the
+        default permissions (0o666 minus the umask), like open() would.
+
+        If `durable` is True, the new file and its directory entry are
+        flushed to disk (fsync), so the new file also survives a crash.
+    """
+    def __init__(self, filename, mode='wb', durable=False, buffering=-1):
+        self.filename = filename
+        self.mode = mode or 'wb'
+        self.durable = durable
+        self.buffering = buffering
+        self.file = None
+        self.filename_tmp = None
+
+    def __enter__(self):
+        # Replace the real file, not a symlink to it.
+        self.filename = os.path.realpath(self.filename)
+        dirname, basename = os.path.split(self.filename)
+        while True:
+            # A unique name, so concurrent writers don't collide.
+            tmpname = os.path.join(
+                dirname,
+                '.{}.{}.tmp'.format(basename, os.urandom(4).hex()),
+            )
+            try:
+                fd = os.open(
+                    tmpname,
+                    os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                    0o666,
+                )
+            except FileExistsError:
+                continue
+            break
+        self.filename_tmp = tmpname
+        try:
+            self.file = os.fdopen(fd, self.mode, buffering=self.buffering)
+        except BaseException:
+            os.close(fd)
+            os.remove(tmpname)
+            raise
+        return self.file
+
+    def __exit__(self, typ, val, trace):
+        if val is not None:
+            self.discard()
+            return False
+        try:
+            if self.durable:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            self.file.close()
+            try:
+                shutil.copymode(self.filename, self.filename_tmp)
+            except FileNotFoundError:
+                # New file, keep the default permissions.
+                pass
+            os.replace(self.filename_tmp, self.filename)
+        except BaseException:
+            self.discard()
+            raise
+        if self.durable:
+            fsync_dir(self.filename)
+        return False
+
+    def discard(self):
+        """ Close and remove the temporary file, without replacing
+            self.filename.
+        """
+        try:
+            self.file.close()
+        except Exception:
+            pass
+        try:
+            os.remove(self.filename_tmp)
+        except FileNotFoundError:
+            pass
+
+
 class BackedUpWriter(object):
     """ A context manager that backs up files when opening in write mode,
         and deletes the backup if no errors occurred while the file was open.
@@ -306,34 +752,68 @@ class BackedUpWriter(object):
 
         If the file does not exist yet, no backup is made, but the file is
         deleted if errors occur.
+
+        If `durable` is True, the file is flushed to disk (fsync) before the
+        backup is removed, so it survives a crash.
     """
-    def __init__(self, filename, fmt='{}~'):
+    def __init__(self, filename, fmt='{}~', mode='w', durable=False):
         self.filename = filename
         self.fmt = fmt or '{}~'
+        self.mode = mode or 'w'
+        self.durable = durable
         self.file = None
         self.filename_backup = None
+        self.created = False
 
     def __enter__(self):
+        try:
+            # New files need no backup, create them without checking first.
+            fd = os.open(
+                self.filename,
+                os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                0o666,
+            )
+        except FileExistsError:
+            pass
+        else:
+            try:
+                self.file = os.fdopen(fd, self.mode)
+            except Exception:
+                os.close(fd)
+                raise
+            self.created = True
+            return self.file
+
         backupfile = self.fmt.format(self.filename)
         try:
             shutil.copy2(self.filename, backupfile)
         except FileNotFoundError:
-            # The file doesn't exist yet.
+            # The file was removed after checking for it.
             pass
         else:
             # Backup created.
             self.filename_backup = backupfile
-        self.file = open(self.filename, 'w')
+        self.file = open(self.filename, self.mode)
         return self.file
 
     def __exit__(self, typ, val, trace):
+        error = val
+        if (error is None) and self.durable:
+            try:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                if self.created:
+                    fsync_dir(self.filename)
+            except OSError as ex:
+                # Not written, handle it like any other error.
+                error = ex
         try:
             self.file.close()
         except Exception:
             pass
         if self.filename_backup:
             # Backup was created.
-            if val is None:
+            if error is None:
                 # No errors, remove the backup.
                 os.remove(self.filename_backup)
             else:
@@ -341,10 +821,12 @@ class BackedUpWriter(object):
                 shutil.move(self.filename_backup, self.filename)
         else:
             # No backup was created.
-            if val is not None:
+            if error is not None:
                 # Errors occurred.
                 try:
                     os.remove(self.filename)
                 except FileNotFoundError:
                     # Never was created in the first place.
                     pass
+        if (val is None) and (error is not None):
+            raise error
@@ -5,7 +5,7 @@ import sys
 import pickle
 from datetime import date, datetime
 
-from .common_base import preferred_file
+from .common_base import preferred_file, ReplacingWriter
 
 # easy settings version
 __version__ = '4.0.1'
@@ -28,6 +28,11 @@ class __NoValue(object):
 # Singleton "not set yet" instance.
 NoValue = __NoValue()
 
+# Value types that can't change without being set again.
+IMMUTABLE_TYPES = frozenset((
+    bool, bytes, complex, date, datetime, float, int, str, type(None),
+))
+
 
 class EasySettings(object):
 
@@ -72,6 +77,17 @@ class EasySettings(object):
             # settings can be saved to disk while setting an option
             settings.setsave('installdir', '/usr/share/easysettings')
     """
+    # Attributes are kept in slots, but '__dict__' allows adding your own.
+    __slots__ = (
+        '__dict__',
+        '_saved_state',
+        'configfile',
+        'header',
+        'name',
+        'settings',
+        'version',
+    )
+
     # Pattern for detecting app name and version on config load.
     # Should stay consistent with the strings in self._build_header().
     confpat = re.compile(r'# Configuration for (.+)')
@@ -125,6 +141,8 @@ class EasySettings(object):
 
         # empty setting dictionary
         self.settings = {}
+        # Info about the last save(), for updating single options.
+        self._saved_state = None
         # load setting from config file
         self.load_file()
 
@@ -132,6 +150,36 @@ class EasySettings(object):
         """ An EasySettings is truthy if it's settings are truthy. """
         return bool(self.settings)
 
+    def __getstate__(self):
+        """ Pickle attributes as a dict, which every pickle protocol can
+            handle (protocols 0 and 1 can't pickle slots by themselves).
+            The saved file info is left out, because an unpickled copy
+            never saved that file.
+        """
+        state = dict(self.__dict__)
+        for attr in EasySettings.__slots__:
+            if attr in ('__dict__', '_saved_state'):
+                continue
+            try:
+                state[attr] = getattr(self, attr)
+            except AttributeError:
+                # Not set yet.
+                pass
+        return state
+
+    def __setstate__(self, state):
+        """ Restore pickled attributes. Pickles may hold a dict, or a
+            (dict, slots) tuple.
+        """
+        if isinstance(state, tuple):
+            attrs, slotattrs = state
+        else:
+            attrs, slotattrs = state, None
+        for d in (attrs, slotattrs):
+            for k, v in (d or {}).items():
+                setattr(self, k, v)
+        self._saved_state = None
+
     def _as_comparable(self, other=NoValue):
         """ Return self.settings if `other` is not given.
             If `other` is given, return other.settings or dict(other).
@@ -152,6 +200,19 @@ class EasySettings(object):
             )
         )
 
+    def _as_orderable(self, other, opname):
+        """ Like _as_comparable(), for the ordering operators.
+            Raises esCompareError if `other` is not an EasySettings or dict.
+        """
+        try:
+            return self._as_comparable(other)
+        except TypeError:
+            raise esCompareError(
+                '{} only compares EasySettings instances or dicts.'.format(
+                    opname,
+                )
+            )
+
     def _build_header(self):
         """ Build the first line for the config file, a comment line
             that describes what the config file is for.
@@ -165,6 +226,54 @@ class EasySettings(object):
                 lines.append('v. {}'.format(self.version))
         return ' '.join(lines)
 
+    def _build_saved_state(self, filename, headerlines, items, encoding):
+        """ Build the info needed to update single lines in a saved file,
+            with the byte offset and length for each setting's line.
+            `items` are the (key, line) pairs, in the order they were saved.
+            Returns None when the file can't be updated in place.
+        """
+        if '\n'.encode(encoding) != b'\n':
+            # Not an ascii-compatible encoding, offsets would be wrong.
+            return None
+        values = dict(self.settings)
+        if not all(type(v) in IMMUTABLE_TYPES for v in values.values()):
+            # Mutable values could change without the file knowing about it.
+            return None
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+
+        newline = len(os.linesep.encode(encoding))
+        pos = sum(
+            len(s.replace('\n', os.linesep).encode(encoding)) + newline
+            for s in headerlines
+        )
+        offsets = {}
+        for skey, line in items:
+            length = len(line.encode(encoding))
+            offsets[skey] = (pos, length)
+            pos += length + newline
+        return {
+            'filename': filename,
+            'headerlines': headerlines,
+            'encoding': encoding,
+            'stat': (st.st_mtime_ns, st.st_size),
+            'offsets': offsets,
+            'values': values,
+        }
+
+    def _build_header_lines(self):
+        """ Build all header lines for the config file, using
+            self._build_header() and self._parse_header().
+            Returns a list of str, with no newlines at the end.
+        """
+        lines = [self._build_header()]
+        header = self._parse_header()
+        if header:
+            lines.append(header)
+        return lines
+
     def _get_compare_args(self, other, other2=NoValue):
         """ Determines which two instances are being compared by args.
             Returns either:
@@ -177,6 +286,151 @@ class EasySettings(object):
             return self._as_comparable(), self._as_comparable(other)
         return self._as_comparable(other), self._as_comparable(other2)
 
+    def _read_settings(self, sfile):
+        """ Reads a config file, returns a settings dict.
+            Returns None if the file doesn't exist, or isn't a file.
+            The file is opened without checking it first, so the common case
+            doesn't need an extra stat() call.
+        """
+        try:
+            f = open(sfile, 'r')
+        except OSError:
+            if os.path.isfile(sfile):
+                # Exists, but can't be read.
+                raise
+            return None
+
+        tmp_dict = {}
+        with f:
+            # cycle thru lines
+            for sline in f:
+                # Skip comment lines.
+                if sline.lstrip().startswith('#'):
+                    continue
+
+                # actual setting?
+                sopt, sep, sval = sline.partition('=')
+                if not (sep and sopt.replace(' ', '')):
+                    # No '=', or an empty option that set() would reject.
+                    continue
+
+                sval = sval.replace('(es_nl)', '\n')
+
+                # Valid setting. Option names are interned, so configs with
+                # the same options share one copy of each name.
+                tmp_dict[sys.intern(sopt)] = parse_value(sval)
+        # success (filled dict)
+        return tmp_dict
+
+    def _save_option(self, option):
+        """ Save a single option by updating it's line in the config file,
+            without rewriting the entire file.
+            This only works when nothing else has changed since the last
+            save(), the file hasn't been modified by anything else, and the
+            new line fits in the old line's place (or is a new option).
+            Returns True if the option was saved, otherwise False (a full
+            save() is needed).
+        """
+        state = getattr(self, '_saved_state', None)
+        if (state is None) or (state['filename'] != self.configfile):
+            return False
+        value = self.settings.get(option, NoValue)
+        if type(value) not in IMMUTABLE_TYPES:
+            return False
+        if self._build_header_lines() != state['headerlines']:
+            return False
+        # Everything else must be exactly what was saved last time.
+        values = state['values']
+        expected = len(values) + (0 if option in values else 1)
+        if len(self.settings) != expected:
+            return False
+        for skey, val in values.items():
+            if skey == option:
+                continue
+            if self.settings.get(skey, NoValue) is not val:
+                return False
+
+        try:
+            st = os.stat(self.configfile)
+        except OSError:
+            return False
+        if (st.st_mtime_ns, st.st_size) != state['stat']:
+            # Modified by something else.
+            return False
+
+        encoding = state['encoding']
+        try:
+            line = '{}={}'.format(option, format_value(value))
+            linebytes = line.encode(encoding)
+        except Exception:
+            return False
+        offsets = state['offsets']
+        slot = offsets.get(option, None)
+        if (slot is not None) and (slot[1] != len(linebytes)):
+            # Different size, the rest of the file has to move.
+            return self._save_option_resized(option, value, linebytes)
+
+        if slot is None:
+            # New option, append it.
+            start = st.st_size
+            data = linebytes + os.linesep.encode(encoding)
+        else:
+            # Same size, overwrite it.
+            start = slot[0]
+            data = linebytes
+
+        try:
+            with open(self.configfile, 'r+b') as f:
+                f.seek(start)
+                f.write(data)
+                f.flush()
+                st = os.fstat(f.fileno())
+        except OSError:
+            # The next full save() will take care of it.
+            self._saved_state = None
+            return False
+        offsets[option] = (start, len(linebytes))
+        values[option] = value
+        state['stat'] = (st.st_mtime_ns, st.st_size)
+        return True
+
+    def _save_option_resized(self, option, value, linebytes):
+        """ Replace an option's line with a line of a different size.
+            The unchanged parts of the file before and after the line are
+            copied by the kernel into a new file, which replaces the old one.
+            Returns False if os.copy_file_range() is not available/supported,
+            meaning a full save() is needed.
+        """
+        if getattr(os, 'copy_file_range', None) is None:
+            return False
+        state = self._saved_state
+        offsets = state['offsets']
+        start, oldlength = offsets[option]
+        end = start + oldlength
+        size = state['stat'][1]
+
+        try:
+            with open(self.configfile, 'rb') as fsrc:
+                # The temporary file is removed if anything fails.
+                with ReplacingWriter(self.configfile, buffering=0) as fdst:
+                    src, dst = fsrc.fileno(), fdst.fileno()
+                    copy_range(src, dst, 0, start)
+                    write_all(dst, linebytes)
+                    copy_range(src, dst, end, size - end)
+            st = os.stat(self.configfile)
+        except OSError:
+            return False
+
+        # Lines after this one have moved.
+        shift = len(linebytes) - oldlength
+        for skey, (pos, length) in offsets.items():
+            if pos > start:
+                offsets[skey] = (pos + shift, length)
+        offsets[option] = (start, len(linebytes))
+        state['values'][option] = value
+        state['stat'] = (st.st_mtime_ns, st.st_size)
+        return True
+
     def _parse_header(self):
         """ Parses self.header and converts it to comment lines.
             If no self.header is set, None is returned.
@@ -326,13 +580,8 @@ class EasySettings(object):
         if self.configfile is None:
             return False
 
-        msg = self._build_header()
-        header = self._parse_header()
-
         with open(self.configfile, 'w') as f:
-            f.write('{}\n'.format(msg))
-            if header:
-                f.write('{}\n'.format(header))
+            f.write('{}\n'.format('\n'.join(self._build_header_lines())))
         return True
 
     def configfile_exists(self, bcreateblank=True):
@@ -484,17 +733,19 @@ class EasySettings(object):
 
     def has_option(self, option):
         """ Returns True if soption is in settings. """
-        return (option in self.settings.keys())
+        return option in self.settings
 
     def has_value(self, value):
-        """ Returns True if svalue is in settings. """
-        # had to lengthen the code after adding non-string types
-
+        """ Returns True if svalue is in settings.
+            This is a scan of self.settings.values(), because self.settings
+            can be modified directly, and an index of values could not be
+            kept up to date.
+        """
         try:
-            hasit = (value in self.settings.values())
+            return value in self.settings.values()
         except Exception:
-            hasit = False
-        return hasit
+            # Some non-string types may not be comparable.
+            return False
 
     def items(self):
         """ Alias for self.settings.items() """
@@ -524,11 +775,7 @@ class EasySettings(object):
             return list(self.settings)
 
         query = str_(ssearch_query)
-        lst_tmp = []
-        for itm in list(self.settings.keys()):
-            if query in str_(itm):
-                lst_tmp.append(itm)
-        return lst_tmp
+        return [itm for itm in self.settings if query in str_(itm)]
 
     def list_settings(self, ssearch_query=None):
         """ Returns a list of all settings.
@@ -543,19 +790,27 @@ class EasySettings(object):
                 testsettings = settings.list_settings('test')
                 # returns [('testoption1', 'value1'), ...]
         """
+        if ssearch_query is None:
+            return list(self.settings.items())
 
-        lst_tmp = []
-        for skey in self.settings:
-            if ssearch_query is None:
-                lst_tmp.append((skey, self.settings[skey]))
-            else:
-                val = self.settings[skey]
-                strform = '{}={}'.format(skey, val)
-                if ((str_(ssearch_query) in strform) or
-                        (ssearch_query == skey) or
-                        (ssearch_query == val)):
-                    lst_tmp.append((skey, self.settings[skey]))
-        return lst_tmp
+        query = str_(ssearch_query)
+        if '=' in query:
+            # The query may span the key and value, so build the line.
+            def matches(skey, val):
+                return query in '{}={}'.format(skey, val)
+        else:
+            def matches(skey, val):
+                return (query in str(skey)) or (query in str(val))
+
+        return [
+            (skey, val)
+            for skey, val in self.settings.items()
+            if (
+                matches(skey, val) or
+                (ssearch_query == skey) or
+                (ssearch_query == val)
+            )
+        ]
 
     def list_values(self, ssearch_query=None):
         """ Returns a list() of all current values.
@@ -572,13 +827,8 @@ class EasySettings(object):
         if ssearch_query is None:
             return list(self.settings.values())
 
-        lst_tmp = []
         query = str_(ssearch_query)
-        for itm in list(self.settings.values()):
-            # <a3
-            if query in str_(itm):
-                lst_tmp.append(itm)
-        return lst_tmp
+        return [itm for itm in self.settings.values() if query in str_(itm)]
 
     def load_file(self, sfile=None):
         """ Reads config file into settings object """
@@ -589,13 +839,18 @@ class EasySettings(object):
             # Use this file from now on.
             self.configfile = sfile
 
-        if not os.path.isfile(self.configfile):
+        settings = self._read_settings(self.configfile)
+        if settings is None:
             return False
 
-        settings = self.read_file_noset()
-
-        for k in settings:
-            self.set(k, settings[k])
+        if type(self).set is not EasySettings.set:
+            # A subclass may convert or check options in set().
+            for k, v in settings.items():
+                self.set(k, v)
+            return True
+        # Options from the file are already valid, set() isn't needed.
+        for k, v in settings.items():
+            self.settings[k] = '' if v is None else v
         return True
 
     def load_pickle(self, spicklefile=None):
@@ -654,45 +909,8 @@ class EasySettings(object):
                 return {}
             sfile = self.configfile
 
-        tmp_dict = {}
-
-        if not os.path.isfile(sfile):
-            return tmp_dict
-
-        with open(sfile, 'r') as f:
-            # cycle thru lines
-            for sline in f:
-                # Skip comment lines.
-                if sline.lstrip().startswith('#'):
-                    continue
-
-                # actual setting?
-                try:
-                    eqindex = sline.index('=')
-                except ValueError:
-                    continue
-
-                sopt = sline[:eqindex]
-                sval = sline[eqindex + 1:].replace('(es_nl)', '\n')
-
-                try:
-                    # non-string typed value
-                    val = safe_pickle_obj(sval)
-                except Exception:
-                    # normal string value
-                    val = sval.rstrip()
-                    try:
-                        dateval = datetime.strptime(val, ISO8601)
-                    except ValueError:
-                        # Not a datetime.
-                        pass
-                    else:
-                        val = dateval
-
-                # Valid setting.
-                tmp_dict[sopt] = val
-            # success (filled dict)
-            return tmp_dict
+        settings = self._read_settings(sfile)
+        return {} if settings is None else settings
 
     def reload_file(self):
         """ same as load_file, except self.configfile must be set already """
@@ -712,32 +930,29 @@ class EasySettings(object):
             else:
                 sfile = self.configfile
 
-        # Set header line (name and version.)
-        msg = self._build_header()
-        header = self._parse_header()
-
+        # Write to a temporary file first, and move it over the real file
+        # once everything is written, to avoid partially-written configs.
         try:
-            with open(sfile, 'w') as fwrite:
-                fwrite.write('{}\n'.format(msg))
-                if header:
-                    fwrite.write('{}\n'.format(header))
-                for skey in list(self.settings.keys()):
-                    val = self.settings[skey]
-                    if isinstance(val, str):
-                        sval = val.replace('\n', '(es_nl)')
-                    elif isinstance(val, (date, datetime)):
-                        sval = val.strftime(ISO8601)
-                    else:
-                        sval = safe_pickle_str(val).replace('\n', '(es_nl)')
-                    fwrite.write(skey + '=' + sval + '\n')
-                fwrite.flush()
-                # success
-                return True
-            return False
+            # Set header lines (name, version, and header.)
+            headerlines = self._build_header_lines()
+            items = [
+                (skey, '{}={}'.format(skey, format_value(val)))
+                for skey, val in self.settings.items()
+            ]
+            lines = [line for _, line in items]
+            with ReplacingWriter(sfile, mode='w') as fwrite:
+                # One write for the whole file.
+                fwrite.write('{}\n'.format('\n'.join(headerlines + lines)))
+                encoding = fwrite.encoding
         except Exception as ex:
-            # failed to open file
             raise esSaveError(ex)
-            return False
+        self._saved_state = self._build_saved_state(
+            sfile,
+            headerlines,
+            items,
+            encoding,
+        )
+        return True
 
     def save_pickle(self, spicklefile=None):
         """ saves easysettings object into pickle file...
@@ -783,6 +998,10 @@ class EasySettings(object):
             if len(soption.replace(' ', '')) == 0:
                 raise esSetError('Empty options are not allowed!')
 
+            if type(soption) is str:
+                # Share option names with the ones loaded from files.
+                soption = sys.intern(soption)
+
             # dict must be able to hold it
             try:
                 self.settings[soption] = value
@@ -824,6 +1043,8 @@ class EasySettings(object):
         """
         try:
             if self.set(soption, svalue):
+                if self._save_option(soption):
+                    return True
                 return self.save()
             else:
                 errmsg = 'Unable to set option: {}={!r}'.format(
@@ -842,23 +1063,16 @@ class EasySettings(object):
                 settings.remove(['user', 'homedir', ...])
 
         """
-        if isinstance(option, (list, tuple)):
-            actualitem = self.settings.get(option, NoValue)
-            if actualitem is NoValue:
-                # List of options.
-                errs = 0
-                for itm in option:
-                    try:
-                        self.settings.pop(itm)
-                    except KeyError:
-                        errs += 1
-                return not errs
+        if isinstance(option, list) or (
+                isinstance(option, tuple) and (option not in self.settings)):
+            # List of options.
+            errs = 0
+            for itm in option:
+                if self.settings.pop(itm, NoValue) is NoValue:
+                    errs += 1
+            return not errs
         # Single item.
-        try:
-            self.settings.pop(option)
-        except KeyError:
-            return False
-        return True
+        return self.settings.pop(option, NoValue) is not NoValue
 
     def __getitem__(self, key):
         """ Shortcut to EasySettings.get() using dict/list behavior.
@@ -892,78 +1106,21 @@ class EasySettings(object):
 
     def __gt__(self, other):
         """ tests size of settings lists """
-
-        try:
-            b_esinstance = isinstance(other, EasySettings)
-        except Exception:
-            b_esinstance = False
-
-        if b_esinstance:
-            set2 = other.settings
-        elif isinstance(other, dict):
-            set2 = other
-        else:
-            raise esCompareError(
-                '__lt__ only compares EasySettings instances or dicts.'
-            )
-            return False
-        return (len(self.settings) > len(set2))
+        return len(self.settings) > len(self._as_orderable(other, '__gt__'))
 
     def __lt__(self, other):
         """ tests size of settings lists """
-
-        try:
-            b_esinstance = isinstance(other, EasySettings)
-        except Exception:
-            b_esinstance = False
-        if b_esinstance:
-            set2 = other.settings
-        elif isinstance(other, dict):
-            set2 = other
-        else:
-            raise esCompareError(
-                '__lt__ only compares easysettings instances or dicts.'
-            )
-            return False
-
-        return (len(self.settings) < len(set2))
+        return len(self.settings) < len(self._as_orderable(other, '__lt__'))
 
     def __ge__(self, other):
         """ tests size of settings lists """
-
-        try:
-            b_esinstance = isinstance(other, EasySettings)
-        except Exception:
-            b_esinstance = False
-        if b_esinstance:
-            set2 = other.settings
-        elif isinstance(other, dict):
-            set2 = other
-        else:
-            raise esCompareError(
-                '__lt__ only compares easysettings instances or dicts.'
-            )
-            return False
-
+        set2 = self._as_orderable(other, '__ge__')
         return ((len(self.settings) > len(set2)) or
                 self.compare_settings(set2))
 
     def __le__(self, other):
         """ tests size of settings lists """
-
-        try:
-            b_esinstance = isinstance(other, EasySettings)
-        except Exception:
-            b_esinstance = False
-        if b_esinstance:
-            set2 = other.settings
-        elif isinstance(other, dict):
-            set2 = other
-        else:
-            raise esCompareError(
-                '__lt__ only compares easysettings instances or dicts.'
-            )
-            return False
+        set2 = self._as_orderable(other, '__le__')
         return ((len(self.settings) < len(set2)) or
                 self.compare_settings(set2))
 
@@ -1006,6 +1163,53 @@ class esValueError(esError):
     pass
 
 
+def copy_range(src, dst, offset, count):
+    """ Copy `count` bytes from file descriptor `src`, starting at `offset`,
+        to the current position of file descriptor `dst`, using
+        os.copy_file_range().
+    """
+    while count > 0:
+        copied = os.copy_file_range(src, dst, count, offset)
+        if not copied:
+            raise OSError('Unexpected end of file while copying.')
+        offset += copied
+        count -= copied
+
+
+def format_value(value):
+    """ Returns a single-line str form of a setting value, for saving.
+        Strings are saved as-is, dates/datetimes are saved in ISO8601 format,
+        and everything else is pickled.
+    """
+    if isinstance(value, str):
+        return value.replace('\n', '(es_nl)')
+    elif isinstance(value, (date, datetime)):
+        return value.strftime(ISO8601)
+    return safe_pickle_str(value).replace('\n', '(es_nl)')
+
+
+def parse_value(sval):
+    """ Parses a raw value from a config file line, the opposite of
+        format_value().
+        Returns the unpickled object, a date/datetime, or a str.
+    """
+    # Every pickle ends with a STOP ('.') opcode, so values without one
+    # are plain strings. This skips a raised exception for most str values.
+    if '.' in sval:
+        try:
+            # non-string typed value
+            return safe_pickle_obj(sval)
+        except Exception:
+            pass
+    # normal string value
+    val = sval.rstrip()
+    try:
+        return datetime.strptime(val, ISO8601)
+    except ValueError:
+        # Not a datetime.
+        return val
+
+
 def pickled_str(pickle_dumps_returned):
     """ Returns Python 2 and 3 safe string for converting pickle.dumps().
         Will always return String, not Bytes like Python3 wants to.
@@ -1048,6 +1252,13 @@ def str_(data):
     return str(data)
 
 
+def write_all(fd, data):
+    """ Write all of `data` to file descriptor `fd`, using os.write(). """
+    with memoryview(data) as view:
+        while view:
+            view = view[os.write(fd, view):]
+
+
 def version():
     """ returns version string. """
     return __version__
@@ -5,15 +5,151 @@
     Christopher Welborn 01-16-2015
 """
 
-import json
+import math
+import mmap
+import os
+import re
+import threading
 
 from .common_base import (
     load_settings,
+    NotSet,
     SettingsBase,
+    write_replace,
 )
 
 __all__ = ['JSONSettings', 'load_json_settings']
 
+# Files this size or larger are mmap'd for orjson, instead of read.
+MMAP_MIN_SIZE = 64 * 1024
+
+# 19 digits in a row may be an integer that doesn't fit in 64 bits, which
+# orjson/simdjson would decode as a float. json keeps it exact.
+# (Long fractions and strings of digits match too, and just use json.)
+BIG_INT_RE = re.compile(br'[0-9]{19}')
+
+# JSON modules are imported on first use, see _get_json()/_get_orjson().
+_json = None
+_orjson = NotSet
+_simdjson = NotSet
+# Per-thread simdjson.Parser, see _get_simdjson_parser().
+_simdjson_local = threading.local()
+
+
+def _get_json():
+    """ Returns the `json` module, importing it on first use. """
+    global _json
+    if _json is None:
+        import json as _json
+    return _json
+
+
+def _get_orjson():
+    """ Returns the `orjson` module, importing it on first use.
+        orjson is faster, and is used when no custom encoder/decoder is used.
+        Returns None if orjson is not installed.
+    """
+    global _orjson
+    if _orjson is NotSet:
+        try:
+            import orjson as _orjson
+        except ImportError:
+            _orjson = None
+    return _orjson
+
+
+def _get_simdjson():
+    """ Returns the `simdjson` module (pysimdjson), importing it on first use.
+        It is used for loading when orjson is not installed.
+        Returns None if simdjson is not installed.
+    """
+    global _simdjson
+    if _simdjson is NotSet:
+        try:
+            import simdjson as _simdjson
+        except ImportError:
+            _simdjson = None
+    return _simdjson
+
+
+def _get_fast_loads():
+    """ Returns the fastest available `loads()` function for plain JSON
+        (without a custom decoder), from orjson or simdjson.
+        Returns None if neither one is installed.
+    """
+    orjson = _get_orjson()
+    if orjson is not None:
+        return orjson.loads
+    if _get_simdjson() is not None:
+        return _simdjson_loads
+    return None
+
+
+def _orjson_exact(obj):
+    """ Returns True if orjson would encode `obj` the same way json does.
+        orjson writes NaN/Infinity as null, and turns some types (datetime,
+        UUID, dataclasses, str/int/dict subclasses) into JSON where json
+        raises TypeError or uses the custom encoder, so anything other than
+        plain JSON types is left for json.
+        Integers that don't fit in 64 bits make orjson raise instead.
+    """
+    objtype = type(obj)
+    if (objtype is str) or (objtype is int) or (objtype is bool) or (
+            obj is None):
+        return True
+    if objtype is float:
+        return math.isfinite(obj)
+    if objtype is dict:
+        for k, v in obj.items():
+            if (type(k) is not str) or not _orjson_exact(v):
+                return False
+        return True
+    if (objtype is list) or (objtype is tuple):
+        for v in obj:
+            if not _orjson_exact(v):
+                return False
+        return True
+    return False
+
+
+def _fast_loads(loads, raw):
+    """ Decode raw JSON bytes (or a buffer) with orjson/simdjson's `loads()`,
+        falling back to json for documents they won't decode like json does.
+    """
+    if BIG_INT_RE.search(raw) is not None:
+        return _get_json().loads(bytes(raw).decode('utf-8'))
+    try:
+        return loads(raw)
+    except ValueError:
+        # NaN/Infinity are rejected by the fast decoders, but not by json.
+        # Invalid JSON raises json's usual error.
+        return _get_json().loads(bytes(raw).decode('utf-8'))
+
+
+def _get_simdjson_parser():
+    """ Returns a simdjson.Parser for this thread, creating it on first use.
+        Parsers keep their buffers between documents, so reusing one is
+        cheaper for small files, but they can't be shared between threads.
+    """
+    parser = getattr(_simdjson_local, 'parser', None)
+    if parser is None:
+        parser = _simdjson_local.parser = _simdjson.Parser()
+    return parser
+
+
+def _simdjson_loads(raw):
+    """ Decode raw JSON bytes with a simdjson.Parser.
+        The parsed document is only a view into the parser's buffer, so
+        objects and arrays are converted to a real dict/list before the
+        parser is used again.
+    """
+    doc = _get_simdjson_parser().parse(raw)
+    if isinstance(doc, _simdjson.Object):
+        return doc.as_dict()
+    if isinstance(doc, _simdjson.Array):
+        return doc.as_list()
+    return doc
+
 
 def load_json_settings(
         filename, default=None,
@@ -53,6 +189,9 @@ class JSONSettings(SettingsBase):
         The JSON data must be a dict, and all dict keys and values must be
         compatible with JSON serialization.
     """
+    # Deep-copying cached nested data is slower than orjson's decoding.
+    cache_nested = False
+
     def __init__(
             self, iterable=None, filename=None, encoder=None, decoder=None,
             **kwargs):
@@ -68,39 +207,202 @@ class JSONSettings(SettingsBase):
             **kwargs
         )
 
+    def __getattr__(self, key):
+        """ Decode files loaded with load_lazy() the first time self.data is
+            used. self.data is a normal attribute otherwise, so this is
+            never called for it once it is set.
+        """
+        if key != 'data':
+            return super(JSONSettings, self).__getattr__(key)
+        attrs = self.__dict__
+        lazy = attrs.get('_lazy', None)
+        if lazy is None:
+            raise AttributeError('{!s} has no attribute {!s}.'.format(
+                type(self).__name__,
+                key,
+            ))
+        raw, kwargs, data = lazy
+        # Decoding errors are raised on every use, until it succeeds.
+        decoded = self._decode(raw, **kwargs)
+        attrs['data'] = data
+        try:
+            self._update_loaded(decoded)
+        except BaseException:
+            del attrs['data']
+            raise
+        del attrs['_lazy']
+        return data
+
     @classmethod
-    def from_file(cls, filename, encoder=None, decoder=None, **kwargs):
+    def from_file(
+            cls, filename, encoder=None, decoder=None, lazy=False,
+            **kwargs):
         """ Return a new JSONSettings from a JSON file.
             Arguments:
                 filename  : File name to read.
+                lazy      : Whether to wait until the settings are first
+                            used to decode the file (see load_lazy()).
 
             All open() and json.load() exceptions are propagated.
         """
         settings = cls(filename=filename, encoder=encoder, decoder=decoder)
-        settings.load(**kwargs)
+        if lazy:
+            settings.load_lazy(**kwargs)
+        else:
+            settings.load(**kwargs)
         return settings
 
+    def _decode(self, raw, **kwargs):
+        """ Decode raw JSON bytes, using orjson/simdjson when available and
+            no custom decoder or extra json.loads() arguments are used.
+        """
+        loads = None
+        if not any(v is not None for v in kwargs.values()):
+            loads = _get_fast_loads()
+        if loads is None:
+            # json.loads() only accepts bytes on Python 3.6+.
+            return _get_json().loads(raw.decode('utf-8'), **kwargs)
+        return _fast_loads(loads, raw)
+
+    def _read_file(self, module, **kwargs):
+        """ Read and decode self.filename, using orjson/simdjson when
+            available and no custom decoder or extra json.load() arguments
+            are used.
+        """
+        loads = None
+        if not any(v is not None for v in kwargs.values()):
+            loads = _get_fast_loads()
+        if loads is None:
+            return super(JSONSettings, self)._read_file(module, **kwargs)
+
+        with open(self.filename, 'rb') as f:
+            return self._read_fast(f, os.fstat(f.fileno()).st_size, loads)
+
+    def _read_fast(self, f, size, loads):
+        """ Decode an open binary file with orjson/simdjson's `loads()`. """
+        if size < MMAP_MIN_SIZE:
+            # Small (or empty) files are faster to just read.
+            return _fast_loads(loads, f.read())
+        orjson = _get_orjson()
+        if orjson is None:
+            if hasattr(os, 'posix_fadvise'):
+                # The whole file is read in order, let the kernel read ahead.
+                fd = f.fileno()
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                except OSError:
+                    pass
+            return _fast_loads(loads, f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                # The whole file is read in order, let the kernel read ahead.
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapped) as view:
+                return _fast_loads(orjson.loads, view)
+
+    def _write_file(self, module, data, **kwargs):
+        """ Encode and write `data` to self.filename, using orjson when it
+            is available, no custom encoder is used, `indent` is None or 2
+            (all orjson can do), and it would write the same data as json
+            (see _orjson_exact()).
+            The whole file is encoded first, and then written to a temporary
+            file that replaces self.filename.
+        """
+        payload = None
+        orjson = _get_orjson()
+        indent = kwargs.get('indent', None)
+        if (orjson is not None) and (kwargs.get('cls', None) is None) and (
+                indent in (None, 2)) and _orjson_exact(data):
+            options = 0
+            if indent is not None:
+                # orjson can only indent with 2 spaces.
+                options |= orjson.OPT_INDENT_2
+            if kwargs.get('sort_keys', False):
+                options |= orjson.OPT_SORT_KEYS
+            try:
+                payload = orjson.dumps(data, option=options)
+            except orjson.JSONEncodeError:
+                # Some things json can encode, but orjson can't (like
+                # integers bigger than 64 bits). Let json have a try at it.
+                pass
+        if payload is None:
+            # json.dump() would write every little token separately.
+            payload = module.dumps(data, **kwargs).encode('utf-8')
+        # Encoded before opening the file, so it isn't touched on errors.
+        write_replace(self.filename, payload, durable=self.durable)
+
     def load(self, filename=None, **kwargs):
         """ Load this dict from a JSON file.
             Raises the same errors as open() and json.load().
         """
-        super(JSONSettings, self).load(json, cls=self.decoder, **kwargs)
+        super(JSONSettings, self).load(
+            _get_json(),
+            filename=filename,
+            cls=self.decoder,
+            **kwargs
+        )
+
+    def load_lazy(self, filename=None, **kwargs):
+        """ Read a JSON file, but wait until the settings are first used to
+            decode it. This is useful when the settings may never be used.
+            Raises the same errors as open() right away, but json.loads()
+            errors are raised when the settings are first used (every time,
+            until the data can be decoded).
+            Until the settings are used, attributes set on this instance are
+            real attributes, not settings keys. Use settings[key] = value.
+        """
+        if filename:
+            self.filename = filename
+        if not self.filename:
+            raise ValueError('`filename` must be set.')
 
-    def save(self, filename=None, sort_keys=False):
+        # The same arguments as load(), which always reads the file here.
+        self.load_kwargs.update(kwargs)
+        extra_args = dict(self.load_kwargs)
+        extra_args.pop('use_cache', None)
+        sidecar = extra_args.pop('sidecar', None)
+        if sidecar is not None:
+            self.sidecar = sidecar
+        extra_args['cls'] = self.decoder
+        with open(self.filename, 'rb') as f:
+            raw = f.read()
+        attrs = self.__dict__
+        # The existing data is updated when the file is decoded.
+        data = attrs.pop('data', None)
+        if data is None:
+            # Already pending, replace the file but keep the data.
+            data = attrs['_lazy'][2]
+        attrs['_lazy'] = (raw, extra_args, data)
+
+    def save(self, filename=None, sort_keys=False, indent=4, force=False):
         """ Save this dict to a JSON file.
             Raises the same errors as open() and json.dump().
+            Arguments:
+                filename   : File name to save to. Default: self.filename
+                sort_keys  : Whether to sort keys in the output.
+                indent     : Indentation for pretty-printing, or None for
+                             compact output (smaller, and faster to encode).
+                             orjson is only used for None or 2.
+                force      : Whether to write the file even when nothing
+                             changed since it was loaded or saved.
         """
         super(JSONSettings, self).save(
-            json,
+            _get_json(),
             filename=filename,
-            indent=4,
+            force=force,
+            indent=indent,
             sort_keys=sort_keys,
             cls=self.encoder,
         )
 
-    def setsave(self, option, value, filename=None, sort_keys=False):
+    def setsave(
+            self, option, value, filename=None, sort_keys=False, indent=4):
         """ The same as calling .set() and then .save(). """
         super(JSONSettings, self).setsave(
+            option,
+            value,
             filename=filename,
             sort_keys=sort_keys,
+            indent=indent,
         )
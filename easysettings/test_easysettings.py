@@ -4,10 +4,10 @@
 
     -Christopher Welborn 07-14-2015
 """
-from __future__ import print_function
 import os
+import pathlib
+import pickle
 import sys
-import tempfile
 import unittest
 from datetime import (
     date,
@@ -17,40 +17,41 @@ from datetime import (
 from . import (
     __version__ as version,
     EasySettings,
-    ISO8601,
+    esCompareError,
 )
+from .test_helpers import TempDirMixin
 
-try:
-    # For pathlib tests.
-    import pathlib
-except ImportError:
-    pathlib = None
+# Initial content for test files.
+TEST_FILE_CONTENT = b'# Test settings.'
+# A fixed datetime, so date tests are repeatable.
+TEST_DATETIME = datetime(2024, 1, 2, 3, 4, 5)
 
-if sys.version_info.major < 3:
-    FileNotFoundError = IOError
 
-NONEXISTENT_FILE = 'NONEXISTENT_FILE'
-if os.path.exists(NONEXISTENT_FILE):
-    # It's happened before, because of a test failure. :(
-    os.remove(NONEXISTENT_FILE)
+class EasySettingsTests(TempDirMixin, unittest.TestCase):
 
+    """ Tests EasySettings functionality. """
 
-class EasySettingsTests(unittest.TestCase):
+    # Known values to test with.
+    # Assumptions about these values are made in some tests.
+    TEST_VALUES = tuple(
+        ('option{}'.format(i), 'value{}'.format(i))
+        for i in range(1, 4)
+    )
 
-    """ Tests EasySettings functionality. """
+    @classmethod
+    def setUpClass(cls):
+        super(EasySettingsTests, cls).setUpClass()
+        # Copied by make_settings().
+        cls.template = EasySettings()
+        cls.template.set_list(cls.TEST_VALUES)
 
     def setUp(self):
         # Set up a test configuration file to work with.
-        fd, fname = tempfile.mkstemp(suffix='.conf', prefix='easysettings.')
-        os.write(fd, '# Test settings.'.encode())
-        os.close(fd)
-        self.testfile = fname
-        # Known values to test with.
-        # Assumptions about these values are made in some tests.
-        self.test_values = [
-            ('option{}'.format(i), 'value{}'.format(i))
-            for i in range(1, 4)
-        ]
+        self.testfile = os.path.join(
+            self.tmpdir,
+            '{}.conf'.format(self._testMethodName),
+        )
+        self.clear_file(self.testfile)
 
     def assertDateEqual(self, d1, d2, msg=None):
         acceptable = (date, datetime)
@@ -64,11 +65,17 @@ class EasySettingsTests(unittest.TestCase):
                 type(d1).__name__,
                 type(d2).__name__
             ))
-        self.assertEqual(d1.strftime(ISO8601), d2.strftime(ISO8601), msg=msg)
+        # Same fields as ISO8601 (dates have a zero time), without the
+        # strftime() formatting.
+        self.assertEqual(d1.timetuple()[:6], d2.timetuple()[:6], msg=msg)
+
+    def make_settings(self):
+        """ Returns a new EasySettings, with TEST_VALUES already set. """
+        return self.template.copy()
 
     def clear_file(self, filename):
-        with open(filename, 'w') as f:
-            f.write('# Test settings.')
+        with open(filename, 'wb', buffering=0) as f:
+            f.write(TEST_FILE_CONTENT)
 
     def test_add_file(self):
         """ add_file() should merge new files, and raise on non-optional files
@@ -76,7 +83,7 @@ class EasySettingsTests(unittest.TestCase):
         settings = EasySettings()
         settings.settings = {'a': 1, 'b': 2}
         settings2 = EasySettings(self.testfile)
-        settings2.settings = {k: v for k, v in self.test_values}
+        settings2.settings = dict(self.TEST_VALUES)
         settings2.save()
         settings.add_file(self.testfile, optional=False)
         self.assertDictEqual(
@@ -107,10 +114,8 @@ class EasySettingsTests(unittest.TestCase):
 
     def test_compare_opts(self):
         """ compare_settings() should make a good comparison. """
-        es1 = EasySettings()
-        es1.set_list(self.test_values)
-        es2 = EasySettings()
-        es2.set_list(self.test_values)
+        es1 = self.make_settings()
+        es2 = self.make_settings()
         self.assertTrue(
             es1.compare_opts(es2),
             msg='compare_opts(es2) failed for equal instances!',
@@ -132,10 +137,8 @@ class EasySettingsTests(unittest.TestCase):
 
     def test_compare_settings(self):
         """ compare_settings() should make a good comparison. """
-        es1 = EasySettings()
-        es1.set_list(self.test_values)
-        es2 = EasySettings()
-        es2.set_list(self.test_values)
+        es1 = self.make_settings()
+        es2 = self.make_settings()
         self.assertTrue(
             es1.compare_settings(es2),
             msg='compare_settings(es2) failed for equal instances!',
@@ -157,10 +160,8 @@ class EasySettingsTests(unittest.TestCase):
 
     def test_compare_vals(self):
         """ compare_vals() should make a good comparison. """
-        es1 = EasySettings()
-        es1.set_list(self.test_values)
-        es2 = EasySettings()
-        es2.set_list(self.test_values)
+        es1 = self.make_settings()
+        es2 = self.make_settings()
         self.assertTrue(
             es1.compare_vals(es2),
             msg='compare_vals(es2) failed for equal instances!',
@@ -206,10 +207,8 @@ class EasySettingsTests(unittest.TestCase):
 
     def test_comparison_ops(self):
         """ EasySettings comparison operators hold true """
-        es1 = EasySettings()
-        es1.set_list(self.test_values)
-        es2 = EasySettings()
-        es2.set_list(self.test_values)
+        es1 = self.make_settings()
+        es2 = self.make_settings()
         # Extra values for bug #4.
         es1.set('option4', None)
         es2.set('option4', None)
@@ -264,70 +263,98 @@ class EasySettingsTests(unittest.TestCase):
             es2,
             msg='EasySettings with less options was not less or equal!'
         )
+        # Only EasySettings and dicts can be compared.
+        with self.assertRaises(esCompareError):
+            es1 > 'not comparable'
+        with self.assertRaises(esCompareError):
+            es1 <= ['not', 'comparable']
 
     def test_datetimes(self):
         """ EasySettings handles dates/datetimes. """
-        self.clear_file(self.testfile)
         settings = EasySettings(self.testfile)
-        d = datetime.now()
-        settings.set('today', d.date())
-        settings.setsave('now', d)
+        settings.set('today', TEST_DATETIME.date())
+        settings.setsave('now', TEST_DATETIME)
         loaded = EasySettings(self.testfile)
         self.assertDateEqual(
-            d,
+            TEST_DATETIME,
             loaded.get('now'),
             msg='Failed to serialize datetime.'
         )
         self.assertDateEqual(
-            d.date(),
+            TEST_DATETIME.date(),
             loaded.get('today'),
             msg='Failed to serialize date.'
         )
 
+    def test_has_option_value(self):
+        """ has_option() and has_value() find options and values. """
+        settings = self.make_settings()
+        settings.settings['direct'] = ['a', 'list']
+        for opt, val in self.TEST_VALUES:
+            self.assertTrue(
+                settings.has_option(opt),
+                msg='has_option() failed for: {}'.format(opt),
+            )
+            self.assertTrue(
+                settings.has_value(val),
+                msg='has_value() failed for: {}'.format(val),
+            )
+        self.assertTrue(
+            settings.has_value(['a', 'list']),
+            msg='has_value() failed for a value set directly.',
+        )
+        settings.remove('option1')
+        self.assertFalse(
+            settings.has_option('option1'),
+            msg='has_option() found a removed option.',
+        )
+        self.assertFalse(
+            settings.has_value('value1'),
+            msg='has_value() found a removed value.',
+        )
+
     def test_list_values(self):
         """ EasySettings handles lists of options and values """
 
-        settings = EasySettings()
-        settings.set_list(self.test_values)
+        settings = self.make_settings()
 
-        self.assertListEqual(
-            sorted(settings.settings),
-            sorted(settings.list_options()),
+        self.assertCountEqual(
+            settings.settings,
+            settings.list_options(),
             msg='settings.list_options() differs from list(settings)'
         )
 
-        self.assertListEqual(
-            sorted(settings.settings.values()),
-            sorted(settings.list_values()),
+        self.assertCountEqual(
+            settings.settings.values(),
+            settings.list_values(),
             msg='settings.list_values() differs from list(settings.values())'
         )
 
-        self.assertListEqual(
-            sorted(settings.list_settings()),
-            self.test_values,
+        self.assertCountEqual(
+            settings.list_settings(),
+            self.TEST_VALUES,
             msg='list_settings() failed'
         )
 
         # Test queries.
-        self.assertListEqual(
-            sorted(settings.list_options('3')),
+        self.assertCountEqual(
+            settings.list_options('3'),
             ['option3'],
             msg='Search query failed for list_options(\'3\')'
         )
 
-        self.assertListEqual(
-            sorted(settings.list_values('3')),
+        self.assertCountEqual(
+            settings.list_values('3'),
             ['value3'],
             msg='Search query failed for list_values(\'3\')'
         )
 
-        self.assertListEqual(
-            sorted(settings.list_settings('3')),
+        self.assertCountEqual(
+            settings.list_settings('3'),
             [('option3', 'value3')],
             msg='Search query failed for list_settings(\'3\')'
         )
 
-    @unittest.skipUnless(pathlib is not None, 'No pathlib.Path.')
     def test_load_path_obj(self):
         """ loads pathlib.Path objects """
         p = pathlib.Path(self.testfile)
@@ -342,9 +369,9 @@ class EasySettingsTests(unittest.TestCase):
         """ loads first available file """
         files_set = (
             (self.testfile, ),
-            ('NONEXISTENT_FILE', self.testfile),
-            ('NONEXISTENT_FILE', self.testfile, 'NOT_A_FILE'),
-            ('NONEXISTENT_FILE', 'NOT_A_FILE', self.testfile),
+            (self.nonexistent_file, self.testfile),
+            (self.nonexistent_file, self.testfile, 'NOT_A_FILE'),
+            (self.nonexistent_file, 'NOT_A_FILE', self.testfile),
         )
         for files in files_set:
             settings = EasySettings.from_file(files)
@@ -354,14 +381,13 @@ class EasySettingsTests(unittest.TestCase):
                 msg='Failed to set preferred file.',
             )
 
-    @unittest.skipUnless(pathlib is not None, 'no pathlib.Path')
     def test_load_preferred_path(self):
         """ loads first available pathlib.Path """
         files_set = (
             (self.testfile, ),
-            ('NONEXISTENT_FILE', self.testfile),
-            ('NONEXISTENT_FILE', self.testfile, 'NOT_A_FILE'),
-            ('NONEXISTENT_FILE', 'NOT_A_FILE', self.testfile),
+            (self.nonexistent_file, self.testfile),
+            (self.nonexistent_file, self.testfile, 'NOT_A_FILE'),
+            (self.nonexistent_file, 'NOT_A_FILE', self.testfile),
         )
         for files in files_set:
             files = (pathlib.Path(s) for s in files)
@@ -386,13 +412,38 @@ class EasySettingsTests(unittest.TestCase):
             msg='Failed to save file: {}'.format(self.testfile)
         )
 
-        with open(self.testfile) as f:
+        # Only looking for ascii names, no need to decode.
+        with open(self.testfile, 'rb') as f:
             rawdata = f.read()
 
         self.assertTrue(
-            ('new_option' in rawdata) and ('value' in rawdata),
+            (b'new_option' in rawdata) and (b'value' in rawdata),
             msg='Could not find new option in saved data!'
         )
+        self.assertNoTempFiles()
+
+    def test_load_subclass_set(self):
+        """ EasySettings subclasses with their own set() use it to load """
+        class UpperSettings(EasySettings):
+            def set(self, soption, value=None):
+                return super(UpperSettings, self).set(
+                    soption.upper(),
+                    value,
+                )
+
+        settings = EasySettings(self.testfile)
+        settings.set('option', 'value')
+        settings.save()
+        upper = UpperSettings(self.testfile)
+        self.assertEqual(
+            upper.get('OPTION'),
+            'value',
+            msg='Subclass set() was not used while loading!',
+        )
+        self.assertFalse(
+            upper.has_option('option'),
+            msg='Subclass set() was bypassed while loading!',
+        )
 
     def test_merge(self):
         """ merge should merge existing settings and dicts """
@@ -414,10 +465,54 @@ class EasySettingsTests(unittest.TestCase):
             msg='Failed to merge another dict!',
         )
 
+    def test_pickle(self):
+        """ EasySettings can be pickled and unpickled. """
+        settings = EasySettings(self.testfile, name='test', version='1.0')
+        settings.set_list(self.TEST_VALUES)
+        pklfile = '{}.pkl'.format(self.testfile)
+        self.assertTrue(
+            settings.save_pickle(pklfile),
+            msg='Failed to save pickle file: {}'.format(pklfile),
+        )
+        loaded = EasySettings().load_pickle(pklfile)
+        os.remove(pklfile)
+        self.assertEqual(
+            settings,
+            loaded,
+            msg='Settings differed after pickling!',
+        )
+        for attr in ('configfile', 'name', 'version', 'header'):
+            self.assertEqual(
+                getattr(settings, attr),
+                getattr(loaded, attr),
+                msg='Pickled attribute differs: {}'.format(attr),
+            )
+        # Attributes can still be added, and the saved file info is not
+        # pickled.
+        settings.extra = 'value'
+        settings.save()
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            with self.subTest(protocol=protocol):
+                loaded = pickle.loads(pickle.dumps(settings, protocol))
+                self.assertEqual(
+                    settings,
+                    loaded,
+                    msg='Settings differed after pickling!',
+                )
+                for attr in ('configfile', 'extra'):
+                    self.assertEqual(
+                        getattr(settings, attr),
+                        getattr(loaded, attr),
+                        msg='Pickled attribute differs: {}'.format(attr),
+                    )
+                self.assertIsNone(
+                    loaded._saved_state,
+                    msg='Pickled the saved file info!',
+                )
+
     def test_removals(self):
         """ EasySettings clears and removes items """
-        settings = EasySettings()
-        settings.set_list(self.test_values)
+        settings = self.make_settings()
 
         settings.remove('option3')
         self.assertTrue(
@@ -432,7 +527,15 @@ class EasySettingsTests(unittest.TestCase):
             msg='Failed to remove list of items from settings.'
         )
 
-        settings.set_list(self.test_values)
+        settings.set_list(self.TEST_VALUES)
+        settings.remove(['option1', 'option2', 'option3'])
+        self.assertDictEqual(
+            settings.settings,
+            {},
+            msg='Failed to remove list of items from settings.'
+        )
+
+        settings.set_list(self.TEST_VALUES)
         settings.clear()
         self.assertDictEqual(
             settings.settings,
@@ -440,23 +543,105 @@ class EasySettingsTests(unittest.TestCase):
             msg='Failed to clear all items from settings.'
         )
 
-        settings.set_list(self.test_values)
+        settings.set_list(self.TEST_VALUES)
         settings.clear_values()
         self.assertDictEqual(
             settings.settings,
-            {k: '' for k, _ in self.test_values},
+            {k: '' for k, _ in self.TEST_VALUES},
             msg='Failed to clear all values.'
         )
 
-        settings.set_list(self.test_values)
+        settings.set_list(self.TEST_VALUES)
         clearopts = 'option1', 'option2'
         settings.clear_values(lst_options=clearopts)
         self.assertDictEqual(
-            {k: ('' if k in clearopts else v) for k, v in self.test_values},
+            {k: ('' if k in clearopts else v) for k, v in self.TEST_VALUES},
             settings.settings,
             msg='Failed to clear specified values.'
         )
 
+    def test_save_replace(self):
+        """ save() and setsave() should keep file permissions and symlinks.
+        """
+        os.chmod(self.testfile, 0o600)
+        linkname = '{}.link'.format(self.testfile)
+        os.symlink(self.testfile, linkname)
+        try:
+            settings = EasySettings(linkname)
+            settings.set_list(self.TEST_VALUES)
+            settings.save()
+            # A different size value rewrites the file around the line.
+            settings.setsave('option1', 'a much longer value')
+            self.assertTrue(
+                os.path.islink(linkname),
+                msg='Symlink was replaced by save().',
+            )
+            self.assertEqual(
+                os.stat(self.testfile).st_mode & 0o777,
+                0o600,
+                msg='save() changed the file mode.',
+            )
+            expected = dict(self.TEST_VALUES)
+            expected['option1'] = 'a much longer value'
+            self.assertDictEqual(
+                EasySettings(self.testfile).settings,
+                expected,
+                msg='save() didn\'t write to the symlink target.',
+            )
+        finally:
+            os.remove(linkname)
+
+    def test_setsave(self):
+        """ setsave() saves single options correctly. """
+        settings = EasySettings(self.testfile)
+        settings.set_list(self.TEST_VALUES)
+        settings.save()
+        # Same size value, new option, different size value, non-str value.
+        changes = (
+            ('option1', 'VALUE1'),
+            ('option4', 'value4'),
+            ('option2', 'a much longer value'),
+            ('option3', [1, 2, 3]),
+            ('option1', 'v1'),
+        )
+        expected = dict(self.TEST_VALUES)
+        for opt, val in changes:
+            settings.setsave(opt, val)
+            expected[opt] = val
+            self.assertDictEqual(
+                EasySettings(self.testfile).settings,
+                expected,
+                msg='setsave() failed to save: {}={!r}'.format(opt, val),
+            )
+
+        # Options set without saving should still be saved with setsave().
+        settings.set('unsaved', 'value')
+        settings.setsave('option4', 'VALUE4')
+        expected.update({'unsaved': 'value', 'option4': 'VALUE4'})
+        self.assertDictEqual(
+            EasySettings(self.testfile).settings,
+            expected,
+            msg='setsave() failed to save other changes.',
+        )
+
+        class ItemsReversed(dict):
+            """ Iterates items() and keys in different orders, like dicts
+                may on Python 3.5.
+            """
+            def items(self):
+                return reversed(list(super(ItemsReversed, self).items()))
+
+        settings = EasySettings(self.testfile)
+        settings.settings = ItemsReversed(self.TEST_VALUES)
+        settings.save()
+        settings.setsave('option1', 'VALUE1')
+        expected = dict(self.TEST_VALUES, option1='VALUE1')
+        self.assertDictEqual(
+            EasySettings(self.testfile).settings,
+            expected,
+            msg='setsave() updated the wrong line.',
+        )
+
     def test_set_get_value(self):
         """ EasySettings sets/reads str and non-str values. """
 
@@ -476,11 +661,12 @@ class EasySettingsTests(unittest.TestCase):
 
         for opt, val in test_values:
             settings.set(opt, val)
-            self.assertEqual(
-                val,
-                settings.settings[opt],
-                msg='Failed to set value ({}): {}'.format(type(opt), val)
-            )
+            with self.subTest(opt=opt, val=val):
+                self.assertEqual(
+                    val,
+                    settings.settings[opt],
+                    msg='Failed to set value ({}): {}'.format(type(opt), val)
+                )
         settings.save(self.testfile)
 
         # Reload from disk
@@ -489,17 +675,19 @@ class EasySettingsTests(unittest.TestCase):
             bool(settings),
             msg='Failed to load settings for test!')
 
-        self.assertListEqual(
-            sorted(test_values),
-            sorted(settings.list_settings()),
+        # Option names are unique, dicts compare without any sorting.
+        self.assertDictEqual(
+            dict(test_values),
+            dict(settings.list_settings()),
             msg='Settings differed after saving to disk!')
 
     def test_get_defaults(self):
         """ get() returns correct default values. """
         settings = EasySettings()
-        for default in ('', False, True, None, 1, {}, [], 3.14):
+        # Singletons must come back as-is, not just equal (1 == True).
+        for default in (False, True, None):
             val = settings.get('nonexistent', default=default)
-            if default in (False, True, None):
+            with self.subTest(default=default):
                 self.assertIs(
                     val,
                     default,
@@ -508,7 +696,9 @@ class EasySettingsTests(unittest.TestCase):
                         val,
                     )
                 )
-            else:
+        for default in ('', 1, {}, [], 3.14):
+            val = settings.get('nonexistent', default=default)
+            with self.subTest(default=default):
                 self.assertEqual(
                     val,
                     default,
@@ -527,21 +717,27 @@ class EasySettingsTests(unittest.TestCase):
 
     def test_get_bool(self):
         """ get_bool() returns correct values. """
-        vals = {
-            True: ('true', 'yes', 'on', '1'),
-            False: ('false', 'no', 'off', '0'),
-        }
-        for expected, vals in vals.items():
-            for val in vals:
-                settings = EasySettings()
-                settings.set('boolopt', val)
-                setval = settings.get_bool('boolopt')
+        cases = (
+            ('true', True),
+            ('yes', True),
+            ('on', True),
+            ('1', True),
+            ('false', False),
+            ('no', False),
+            ('off', False),
+            ('0', False),
+        )
+        settings = EasySettings()
+        for i, (val, _) in enumerate(cases):
+            settings.set('boolopt{}'.format(i), val)
+        for i, (val, expected) in enumerate(cases):
+            with self.subTest(val=val):
                 self.assertEqual(
-                    setval,
+                    settings.get_bool('boolopt{}'.format(i)),
                     expected,
                     msg='get_bool() failed for {} value: {}'.format(
                         expected,
-                        setval,
+                        val,
                     ),
                 )
 
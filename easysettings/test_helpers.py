@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+""" test_helpers.py
+    Shared fixtures for the EasySettings unit tests (no tests in here).
+"""
+import itertools
+import os
+import shutil
+import tempfile
+
+
+class TempDirMixin(object):
+    """ Gives a test class a private temporary directory for its files,
+        removed when the class is finished.
+        Use it before unittest.TestCase in the bases.
+    """
+    # Prefix for the temporary directory name.
+    tmpdir_prefix = 'easysettings.'
+    # Extension for file names from make_temp_filename().
+    extension = '.txt'
+
+    @classmethod
+    def setUpClass(cls):
+        super(TempDirMixin, cls).setUpClass()
+        cls.tmpdir = tempfile.mkdtemp(prefix=cls.tmpdir_prefix)
+        # Never created. Kept out of the working directory, so test runs
+        # (even parallel ones) can't trip over each other.
+        cls.nonexistent_file = os.path.join(cls.tmpdir, 'NONEXISTENT_FILE')
+        # Numbers for unique file names in tmpdir.
+        cls.file_numbers = itertools.count()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+        super(TempDirMixin, cls).tearDownClass()
+
+    def assertNoTempFiles(self):
+        """ Fail if a temporary file from a replacing save is left behind.
+        """
+        leftover = [s for s in os.listdir(self.tmpdir) if s.endswith('.tmp')]
+        self.assertListEqual(
+            leftover,
+            [],
+            msg='Temporary files were left behind.',
+        )
+
+    def make_temp_file(self, content):
+        """ Create a new file in tmpdir with `content`, and return its name.
+        """
+        fname = self.make_temp_filename()
+        with open(fname, 'wb') as f:
+            f.write(content)
+        return fname
+
+    def make_temp_filename(self):
+        """ Return a new file name in tmpdir, without creating the file.
+            tmpdir is private to this class, so the name can't be taken.
+        """
+        return os.path.join(
+            self.tmpdir,
+            '{}.{}{}'.format(
+                self._testMethodName,
+                next(self.file_numbers),
+                self.extension,
+            ),
+        )
+
+
+def count_writes(settings):
+    """ Wrap settings._write_file() to record each call.
+        Returns the list that the arguments of each call are added to.
+    """
+    writes = []
+    write_file = settings._write_file
+
+    def counted_write_file(*args, **kwargs):
+        writes.append(args)
+        return write_file(*args, **kwargs)
+
+    settings._write_file = counted_write_file
+    return writes
@@ -6,11 +6,16 @@
 """
 
 # TODO: Test SettingsBase.add_file & SettingsBase.merge!
+import functools
+import inspect
+import math
 import os
 import pathlib
+import shutil
 import sys
 import unittest
-import tempfile
+
+from datetime import date
 
 import json
 try:
@@ -24,11 +29,18 @@ except ImportError:
 
 from .common_base import (
     BackedUpWriter,
+    load_many_settings,
+    ReplacingWriter,
+    SettingsBase,
 )
 from .json_settings import (
     load_json_settings,
     JSONSettings,
 )
+from .test_helpers import (
+    count_writes,
+    TempDirMixin,
+)
 from .toml_settings import (
     load_toml_settings,
     TOMLSettings,
@@ -39,28 +51,61 @@ from .yaml_settings import (
 )
 
 
-class BackedUpWriterTests(unittest.TestCase):
+class CustomDecoder(json.JSONDecoder):
+    def __init__(self, **kwargs):
+        kwargs['object_hook'] = self.object_hooker
+        super(CustomDecoder, self).__init__(**kwargs)
+
+    def object_hooker(self, o):
+        modified = {}
+        for k, v in o.items():
+            if isinstance(v, list):
+                modified[k] = CustomString(
+                    ', '.join('{{{}}}'.format(s) for s in v)
+                )
+            else:
+                modified[k] = v
+        return modified
+
+
+class CustomEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, CustomString):
+            return o.items
+        return super(CustomEncoder, self).default(o)
+
+
+class CustomString(object):
+    __slots__ = ('data', 'items')
+
+    def __init__(self, data):
+        self.data = data if type(data) is str else str(data)
+        # What CustomEncoder saves, '{a}, {b}' -> ('a', 'b').
+        self.items = tuple(x.strip()[1:-1] for x in self.data.split(','))
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        return (type(other) is CustomString) and (self.data == other.data)
+
+    def __hash__(self):
+        return hash(self.data)
+
+
+# Used with CustomEncoder/CustomDecoder, never modified.
+TEST_CUSTOM_STRING = CustomString('{a}, {b}, {c}')
+
+
+class BackedUpWriterTests(TempDirMixin, unittest.TestCase):
     """ Tests for the BackedUpWriter class. """
+    tmpdir_prefix = 'easysettings.BackedUpWriter.'
+
     def setUp(self):
         self.fmt = '{}~'
 
-    def make_temp_file(self):
-        return tempfile.mkstemp(
-            suffix='.txt',
-            prefix='easysettings.BackedUpWriter.'
-        )
-
-    def make_temp_filename(self):
-        return tempfile.mktemp(
-            suffix='.txt',
-            prefix='easysettings.BackedUpWriter.',
-        )
-
     def test_backs_up(self):
         """ Should backup files while opening a file in write mode. """
-        fd, fname = self.make_temp_file()
-        os.write(fd, 'Test Content'.encode())
-        os.close(fd)
+        fname = self.make_temp_file(b'Test Content')
 
         backupname = self.fmt.format(fname)
         with BackedUpWriter(fname, fmt=self.fmt) as f:
@@ -82,6 +127,24 @@ class BackedUpWriterTests(unittest.TestCase):
                 msg='Writing without errors resulted in a bad file!',
             )
 
+    def test_durable(self):
+        """ Should write new and existing files with durable=True. """
+        newfilename = self.make_temp_filename()
+        backupname = self.fmt.format(newfilename)
+        for content in ('New Content', 'Changed Content'):
+            with BackedUpWriter(newfilename, fmt=self.fmt, durable=True) as f:
+                f.write(content)
+            with open(newfilename, 'r') as f:
+                self.assertEqual(
+                    f.read(),
+                    content,
+                    msg='Durable writing resulted in a bad file!',
+                )
+            self.assertFalse(
+                os.path.exists(backupname),
+                msg='Failed to remove backup file: {}'.format(backupname),
+            )
+
     def test_new_files(self):
         """ Should remove new files when errors occur while creating them. """
         newfilename = self.make_temp_filename()
@@ -104,9 +167,7 @@ class BackedUpWriterTests(unittest.TestCase):
 
     def test_restores(self):
         """ Should restore original files on error. """
-        fd, fname = self.make_temp_file()
-        os.write(fd, 'Test Content'.encode())
-        os.close(fd)
+        fname = self.make_temp_file(b'Test Content')
         fmt = '{}~'
         backupname = fmt.format(fname)
         try:
@@ -131,36 +192,117 @@ class BackedUpWriterTests(unittest.TestCase):
             )
 
 
-class SettingsBaseTests(object):
+class ReplacingWriterTests(TempDirMixin, unittest.TestCase):
+    """ Tests for the ReplacingWriter class. """
+    tmpdir_prefix = 'easysettings.ReplacingWriter.'
+
+    def test_keeps_mode(self):
+        """ ReplacingWriter should keep the permissions of existing files. """
+        fname = self.make_temp_file(b'Test Content')
+        os.chmod(fname, 0o600)
+        with ReplacingWriter(fname) as f:
+            f.write(b'New Content')
+        self.assertEqual(
+            os.stat(fname).st_mode & 0o777,
+            0o600,
+            msg='Failed to keep the file mode.',
+        )
+
+    def test_new_files(self):
+        """ ReplacingWriter should create new files with default modes. """
+        fname = self.make_temp_filename()
+        with ReplacingWriter(fname) as f:
+            f.write(b'Test Content')
+        with open(fname, 'rb') as f:
+            self.assertEqual(f.read(), b'Test Content')
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(
+            os.stat(fname).st_mode & 0o777,
+            0o666 & ~umask,
+            msg='New file did not get the default mode.',
+        )
+        self.assertNoTempFiles()
+
+    def test_restores(self):
+        """ ReplacingWriter should leave the file alone on errors. """
+        fname = self.make_temp_file(b'Test Content')
+        with self.assertRaises(ValueError):
+            with ReplacingWriter(fname) as f:
+                f.write(b'Bad Content')
+                raise ValueError('Purposeful error.')
+        with open(fname, 'rb') as f:
+            self.assertEqual(
+                f.read(),
+                b'Test Content',
+                msg='File was replaced after an error.',
+            )
+        self.assertNoTempFiles()
+
+    @unittest.skipUnless(hasattr(os, 'symlink'), 'no symlinks')
+    def test_symlink(self):
+        """ ReplacingWriter should replace the target of a symlink. """
+        fname = self.make_temp_file(b'Test Content')
+        linkname = self.make_temp_filename()
+        os.symlink(fname, linkname)
+        with ReplacingWriter(linkname) as f:
+            f.write(b'New Content')
+        self.assertTrue(
+            os.path.islink(linkname),
+            msg='Symlink was replaced.',
+        )
+        with open(fname, 'rb') as f:
+            self.assertEqual(
+                f.read(),
+                b'New Content',
+                msg='Symlink target was not replaced.',
+            )
+        self.assertNoTempFiles()
+
+    def test_unique_names(self):
+        """ Two ReplacingWriters for one file shouldn't share a temp file. """
+        fname = self.make_temp_file(b'Test Content')
+        writer1 = ReplacingWriter(fname)
+        writer2 = ReplacingWriter(fname)
+        with writer1 as f1:
+            with writer2 as f2:
+                self.assertNotEqual(
+                    writer1.filename_tmp,
+                    writer2.filename_tmp,
+                    msg='Temporary file names collided.',
+                )
+                f2.write(b'Second')
+            f1.write(b'First')
+        with open(fname, 'rb') as f:
+            self.assertEqual(f.read(), b'First')
+        self.assertNoTempFiles()
+
+
+class SettingsBaseTests(TempDirMixin):
     """ Tests pertaining to subclasses of SettingsBase. """
     module = None
     extension = '.testfile'
     settings_hook = None
     settings_cls = None
+    # Known values to test with. Never modified.
+    rawdict = {'option1': 'value1', 'option2': 'value2'}
+
+    @classmethod
+    def setUpClass(cls):
+        super(SettingsBaseTests, cls).setUpClass()
+        # Encoded once, and copied for each test by setUp().
+        cls.template_file = os.path.join(
+            cls.tmpdir,
+            'template{}'.format(cls.extension),
+        )
+        with open(cls.template_file, 'w') as f:
+            cls.module.dump(cls.rawdict, f)
+        cls.settings_hook = create_settings_hook(cls.settings_cls)
 
     def setUp(self):
         """ Setup a test {format} file to work with. """
-        self.rawdict = {'option1': 'value1', 'option2': 'value2'}
-        fname = self.make_temp_filename()
-        with open(fname, 'w') as f:
-            self.module.dump(self.rawdict, f)
-        self.testfile = fname
-
-        self.settings_hook = create_settings_hook(self.settings_cls)
-
-    def make_temp_file(self):
-        return tempfile.mkstemp(
-            suffix='.{}'.format(
-                self.extension.lstrip('.') or self.module.__name__
-            ),
-            prefix='easysettings.'
-        )
-
-    def make_temp_filename(self):
-        return tempfile.mktemp(
-            suffix='.txt',
-            prefix='easysettings.BackedUpWriter.',
-        )
+        self.testfile = self.make_temp_filename()
+        shutil.copyfile(self.template_file, self.testfile)
 
     def test_add_file(self):
         """ add_file() should merge new files, and raise on non-optional files
@@ -248,7 +390,6 @@ class SettingsBaseTests(object):
             ),
         )
 
-    @unittest.skipUnless(pathlib is not None, 'No pathlib.Path.')
     def test_load_path_obj(self):
         """ loads pathlib.Path objects """
         p = pathlib.Path(self.testfile)
@@ -279,9 +420,9 @@ class SettingsBaseTests(object):
         """ loads first available file """
         files_set = (
             (self.testfile, ),
-            ('NONEXISTENT_FILE', self.testfile),
-            ('NONEXISTENT_FILE', self.testfile, 'NOT_A_FILE'),
-            ('NONEXISTENT_FILE', 'NOT_A_FILE', self.testfile),
+            (self.nonexistent_file, self.testfile),
+            (self.nonexistent_file, self.testfile, 'NOT_A_FILE'),
+            (self.nonexistent_file, 'NOT_A_FILE', self.testfile),
         )
         for files in files_set:
             settings = self.settings_cls.from_file(files)
@@ -308,14 +449,13 @@ class SettingsBaseTests(object):
                 msg='Failed to load dict settings from file.'
             )
 
-    @unittest.skipUnless(pathlib is not None, 'no pathlib.Path.')
     def test_load_preferred_path(self):
         """ loads first available pathlib.Path """
         files_set = (
             (self.testfile, ),
-            ('NONEXISTENT_FILE', self.testfile),
-            ('NONEXISTENT_FILE', self.testfile, 'NOT_A_FILE'),
-            ('NONEXISTENT_FILE', 'NOT_A_FILE', self.testfile),
+            (self.nonexistent_file, self.testfile),
+            (self.nonexistent_file, self.testfile, 'NOT_A_FILE'),
+            (self.nonexistent_file, 'NOT_A_FILE', self.testfile),
         )
         for files in files_set:
             files = (pathlib.Path(s) for s in files)
@@ -355,22 +495,23 @@ class SettingsBaseTests(object):
         settings['option3'] = 'value3'
         settings.save()
 
-        with open(self.testfile) as f:
+        # Only looking for ascii names, no need to decode.
+        with open(self.testfile, 'rb') as f:
             rawdata = f.read()
 
         self.assertTrue(
-            ('option3' in rawdata) and ('value3' in rawdata),
+            (b'option3' in rawdata) and (b'value3' in rawdata),
             msg='Could not find new option in saved data!',
         )
 
         with self.assertRaises(FileNotFoundError, msg='Didn\'t raise on load!'):
-            settings = self.settings_cls.from_file('NONEXISTENT_FILE')
+            settings = self.settings_cls.from_file(self.nonexistent_file)
 
     def test_load_settings(self):
         """ load_settings should ignore FileNotFound and handle defaults.
         """
         try:
-            settings = self.load_func('NONEXISTENT_FILE')
+            settings = self.load_func(self.nonexistent_file)
         except FileNotFoundError:
             self.fail(
                 'load_toml_settings should not raise FileNotFoundError.'
@@ -395,13 +536,68 @@ class SettingsBaseTests(object):
             default={'option1': 'SHOULD_NOT_SET', 'option3': 'SHOULD_SET'},
         )
 
-        d = {k: self.rawdict[k] for k in self.rawdict}
+        d = dict(self.rawdict)
         d['option3'] = 'SHOULD_SET'
         self.assertDictEqual(
             d, settings.data,
             msg='Failed to add default setting.',
         )
 
+    def test_load_cache(self):
+        """ load() should not share cached data between instances. """
+        fname = self.make_temp_filename()
+        self.settings_cls(
+            {'a': 1, 'b': 'two', 'nested': {'c': 3}},
+            filename=fname,
+        ).save()
+        first = self.settings_cls.from_file(fname)
+        first['a'] = 'changed'
+        first['nested']['c'] = 'changed'
+        second = self.settings_cls.from_file(fname)
+        self.assertEqual(
+            second['a'],
+            1,
+            msg='Cached data was modified by another instance.',
+        )
+        self.assertEqual(
+            second['nested']['c'],
+            3,
+            msg='Cached nested data was modified by another instance.',
+        )
+        self.settings_cls({'a': 2, 'b': 'three'}, filename=fname).save()
+        self.assertEqual(
+            self.settings_cls.from_file(fname)['a'],
+            2,
+            msg='Stale cached data was used for a modified file.',
+        )
+        self.assertEqual(
+            self.settings_cls.from_file(fname, use_cache=False)['a'],
+            2,
+            msg='Failed to load without the cache.',
+        )
+
+    def test_load_many_settings(self):
+        """ load_many_settings should load all files, in order. """
+        filenames = [self.testfile, self.nonexistent_file, self.testfile]
+        configs = load_many_settings(
+            self.settings_cls,
+            filenames,
+            default={'option3': 'SHOULD_SET'},
+        )
+        d = dict(self.rawdict)
+        d['option3'] = 'SHOULD_SET'
+        expected = [d, {'option3': 'SHOULD_SET'}, d]
+        self.assertListEqual(
+            [c.data for c in configs],
+            expected,
+            msg='Failed to load many settings files.',
+        )
+        self.assertListEqual(
+            [c.filename for c in configs],
+            filenames,
+            msg='Failed to keep file order in load_many_settings.',
+        )
+
     def test_merge(self):
         """ merge should merge existing settings and dicts """
         settings = self.settings_cls({'a': 1, 'b': 2, 'c': 3})
@@ -420,6 +616,94 @@ class SettingsBaseTests(object):
             msg='Failed to merge another dict!',
         )
 
+    def test_save_mode_symlink(self):
+        """ save() should keep file permissions and symlinks. """
+        os.chmod(self.testfile, 0o600)
+        linkname = '{}.link'.format(self.testfile)
+        os.symlink(self.testfile, linkname)
+        settings = self.settings_cls(self.rawdict, filename=linkname)
+        settings['option3'] = 'value3'
+        settings.save()
+        self.assertTrue(
+            os.path.islink(linkname),
+            msg='Symlink was replaced by save().',
+        )
+        self.assertEqual(
+            os.stat(self.testfile).st_mode & 0o777,
+            0o600,
+            msg='save() changed the file mode.',
+        )
+        self.assertEqual(
+            self.settings_cls.from_file(self.testfile).get('option3'),
+            'value3',
+            msg='save() didn\'t write to the symlink target.',
+        )
+
+    def test_save_unchanged(self):
+        """ save() should skip writing when nothing changed. """
+        settings = self.settings_cls.from_file(self.testfile)
+        writes = count_writes(settings)
+        settings.save()
+        self.assertEqual(len(writes), 0, msg='Wrote an unchanged file.')
+        settings['option1'] = 'value1'
+        settings.save()
+        self.assertEqual(len(writes), 0, msg='Wrote an unchanged value.')
+        settings.save(force=True)
+        self.assertEqual(len(writes), 1, msg='Didn\'t write when forced.')
+
+        settings['option1'] = 'changed'
+        settings.save()
+        self.assertEqual(len(writes), 2, msg='Didn\'t write a new value.')
+        settings.save()
+        self.assertEqual(len(writes), 2, msg='Wrote an unchanged file.')
+        del settings['option1']
+        settings.save()
+        self.assertEqual(len(writes), 3, msg='Didn\'t write a removed key.')
+
+        settings['option2'] = ['nested']
+        settings.save()
+        settings['option2'].append('value')
+        settings.save()
+        self.assertEqual(
+            len(writes),
+            5,
+            msg='Didn\'t write a value that may have changed in place.',
+        )
+
+        del settings['option2']
+        settings.save()
+        self.assertEqual(len(writes), 6, msg='Didn\'t write a removed key.')
+        settings.data['option1'] = 'direct'
+        settings.save()
+        self.assertEqual(
+            len(writes),
+            7,
+            msg='Didn\'t write a value set through .data.',
+        )
+        settings.data.update({'option1': 'updated'})
+        settings.save()
+        self.assertEqual(
+            len(writes),
+            8,
+            msg='Didn\'t write a value set through .data.update().',
+        )
+        settings.data = dict(settings.data, option1=1)
+        settings.save()
+        self.assertEqual(len(writes), 9, msg='Didn\'t write a new .data.')
+        settings.data['option1'] = True
+        settings.save()
+        self.assertEqual(
+            len(writes),
+            10,
+            msg='Didn\'t write a value of a different type.',
+        )
+
+        os.remove(self.testfile)
+        settings.save()
+        self.assertEqual(len(writes), 11, msg='Didn\'t write a missing file.')
+        reloaded = self.settings_cls.from_file(self.testfile, use_cache=False)
+        self.assertEqual(reloaded.data, settings.data)
+
     def test_setattr(self):
         """ setattr() should work for config keys and normal attributes. """
         settings = self.settings_cls(self.rawdict)
@@ -475,8 +759,132 @@ class SettingsBaseTests(object):
             msg='setattr() did not change the real attribute.',
         )
 
+    def test_setsave(self):
+        """ setsave() should set and save new and existing keys. """
+        settings = self.settings_cls(self.rawdict, filename=self.testfile)
+        settings.save()
+        writes = count_writes(settings)
+        settings.setsave('option3', 'value3')
+        settings.setsave('option4', 4)
+        if type(settings)._dump_items is not SettingsBase._dump_items:
+            self.assertEqual(len(writes), 0, msg='Didn\'t append new keys.')
+            self.assertFalse(
+                settings._append_item('option5', 5, kwargs={'indent': 2}),
+                msg='Appended with different save() arguments.',
+            )
+            self.assertTrue(
+                settings._append_item(
+                    'option5',
+                    5,
+                    kwargs=dict(settings._saved[3] or {}),
+                ),
+                msg='Didn\'t append with the same save() arguments.',
+            )
+            del settings['option5']
+        settings.setsave('option1', 'changed')
+        expected = {
+            'option1': 'changed',
+            'option2': 'value2',
+            'option3': 'value3',
+            'option4': 4,
+        }
+        self.assertDictEqual(settings.data, expected, msg='Failed to set.')
+        self.assertDictEqual(
+            self.settings_cls.from_file(self.testfile, use_cache=False).data,
+            expected,
+            msg='Failed to save.',
+        )
+
+    def test_setsave_overrides(self):
+        """ setsave() should use set() and save() overridden in subclasses.
+        """
+        calls = []
+
+        class Settings(self.settings_cls):
+            def set(self, option, value):
+                calls.append('set')
+                super(Settings, self).set(option, value.upper())
+
+        class SavedSettings(self.settings_cls):
+            def save(self, *args, **kwargs):
+                calls.append('save')
+                super(SavedSettings, self).save(*args, **kwargs)
+
+        for cls, method, value in (
+            (Settings, 'set', 'VALUE3'),
+            (SavedSettings, 'save', 'value3'),
+        ):
+            with self.subTest(method=method):
+                settings = cls(self.rawdict, filename=self.testfile)
+                settings.save(force=True)
+                del calls[:]
+                settings.setsave('option3', 'value3')
+                self.assertIn(
+                    method,
+                    calls,
+                    msg='Overridden {}() was skipped.'.format(method),
+                )
+                self.assertEqual(
+                    self.settings_cls.from_file(
+                        self.testfile,
+                        use_cache=False,
+                    )['option3'],
+                    value,
+                    msg='Failed to save with overridden {}().'.format(method),
+                )
+
+    def test_sidecar(self):
+        """ load(sidecar=True) should keep and use a pickled copy. """
+        sidecar = '{}.cache'.format(self.testfile)
+        for _ in range(2):
+            # The second load uses the sidecar, without the memory cache.
+            settings = self.settings_cls.from_file(
+                self.testfile,
+                sidecar=True,
+                use_cache=False,
+            )
+            self.assertTrue(
+                os.path.exists(sidecar),
+                msg='Failed to create the sidecar file.',
+            )
+            self.assertDictEqual(
+                self.rawdict, settings.data,
+                msg='Failed to load dict settings with a sidecar file.'
+            )
+        settings['option3'] = 'value3'
+        settings.save()
+        self.assertEqual(
+            self.settings_cls.from_file(
+                self.testfile,
+                sidecar=True,
+                use_cache=False,
+            ).get('option3', None),
+            'value3',
+            msg='Stale sidecar file was used for a modified file.',
+        )
+
 
 class JSONSettingsBaseTests(SettingsBaseTests):
+    def test_sidecar_default(self):
+        """ A class-level sidecar setting should be kept by __init__(). """
+        params = inspect.signature(self.settings_cls.__init__).parameters
+        if 'sidecar' not in params:
+            self.skipTest('No sidecar argument for {}.'.format(
+                self.settings_cls.__name__,
+            ))
+
+        class Settings(self.settings_cls):
+            sidecar = True
+
+        self.assertTrue(
+            Settings(sidecar=None).sidecar,
+            msg='The class-level sidecar setting was overridden.',
+        )
+        self.assertTrue(
+            Settings(sidecar=True).sidecar,
+            msg='Failed to set sidecar.',
+        )
+
     def test_encoder_decoder(self):
         """ JSONSettings should support custom JSONEncoders/Decoders. """
         fname = self.make_temp_filename()
@@ -486,8 +894,7 @@ class JSONSettingsBaseTests(SettingsBaseTests):
             decoder=CustomDecoder,
             encoder=CustomEncoder,
         )
-        test_val = CustomString('{a}, {b}, {c}')
-        settings['my_str_list'] = test_val
+        settings['my_str_list'] = TEST_CUSTOM_STRING
         settings.save(filename=fname)
 
         notencoded = JSONSettings.from_file(fname)
@@ -500,47 +907,346 @@ class JSONSettingsBaseTests(SettingsBaseTests):
         decoded = JSONSettings.from_file(fname, decoder=CustomDecoder)
         self.assertEqual(
             decoded['my_str_list'],
-            test_val,
+            TEST_CUSTOM_STRING,
             msg='Custom decoder failed:\n{dec!r} != {enc!r}'.format(
                 dec=decoded['my_str_list'].data,
-                enc=test_val.data,
+                enc=TEST_CUSTOM_STRING.data,
             )
         )
 
+    def test_large_ints(self):
+        """ JSONSettings should save/load integers that orjson can't hold.
+        """
+        fname = self.make_temp_filename()
+        for value in (2 ** 70, -2 ** 63 - 1, 2 ** 64 - 1):
+            with self.subTest(value=value):
+                settings = JSONSettings({'big': value}, filename=fname)
+                settings.save()
+                loaded = JSONSettings.from_file(fname, use_cache=False)
+                self.assertIs(
+                    type(loaded['big']),
+                    int,
+                    msg='Large integer was loaded as a float.',
+                )
+                self.assertEqual(
+                    loaded['big'],
+                    value,
+                    msg='Failed to save/load a large integer.',
+                )
 
-class CustomDecoder(json.JSONDecoder):
-    def __init__(self, **kwargs):
-        kwargs['object_hook'] = self.object_hooker
-        super(CustomDecoder, self).__init__(**kwargs)
+    def test_indent(self):
+        """ JSONSettings should save compact or indented JSON. """
+        fname = self.make_temp_filename()
+        settings = JSONSettings(self.rawdict, filename=fname)
+        settings.save(indent=None)
+        with open(fname, 'r') as f:
+            self.assertNotIn('\n', f.read(), msg='Compact JSON was indented.')
+        settings.setsave('new_key', 'new_value')
+        with open(fname, 'r') as f:
+            self.assertIn('\n', f.read(), msg='JSON was not indented.')
+        self.assertEqual(
+            JSONSettings.from_file(fname)['new_key'],
+            'new_value',
+            msg='Failed to setsave() a new key.',
+        )
+        for indent in (2, 4, 8):
+            with self.subTest(indent=indent):
+                settings.save(indent=indent, force=True)
+                with open(fname, 'r') as f:
+                    self.assertEqual(
+                        f.read(),
+                        json.dumps(settings.data, indent=indent),
+                        msg='Failed to honour the indent.',
+                    )
+
+    def test_load_lazy(self):
+        """ JSONSettings should support lazy loading. """
+        settings = JSONSettings.from_file(self.testfile, lazy=True)
+        self.assertIn(
+            '_lazy',
+            settings.__dict__,
+            msg='Lazy settings were decoded before use.',
+        )
+        self.assertDictEqual(
+            self.rawdict, settings.data,
+            msg='Failed to lazy load dict settings from file.'
+        )
+        self.assertNotIn(
+            '_lazy',
+            settings.__dict__,
+            msg='Lazy settings were not decoded on first use.',
+        )
+        with self.assertRaises(FileNotFoundError, msg='Didn\'t raise!'):
+            JSONSettings.from_file(self.nonexistent_file, lazy=True)
 
-    def object_hooker(self, o):
-        modified = {}
-        for k, v in o.items():
-            if isinstance(v, list):
-                modified[k] = CustomString(
-                    ', '.join('{{{}}}'.format(s) for s in v)
+        # Without the fast decoders (custom decoder), and with non-ascii.
+        fname = self.make_temp_filename()
+        with open(fname, 'wb') as f:
+            f.write('{"name": "\u00e9t\u00e9"}'.encode('utf-8'))
+        settings = JSONSettings.from_file(
+            fname,
+            lazy=True,
+            decoder=json.JSONDecoder,
+        )
+        self.assertDictEqual(
+            settings.data,
+            {'name': '\u00e9t\u00e9'},
+            msg='Failed to lazy load with a custom decoder.',
+        )
+
+        # The same load() arguments are accepted.
+        for kwargs in ({'use_cache': False}, {'sidecar': True}):
+            with self.subTest(kwargs=kwargs):
+                settings = JSONSettings.from_file(
+                    self.testfile,
+                    lazy=True,
+                    **kwargs
+                )
+                self.assertDictEqual(
+                    self.rawdict, settings.data,
+                    msg='Failed to lazy load with load() arguments.'
+                )
+                self.assertNotIn(
+                    'cls',
+                    settings.load_kwargs,
+                    msg='Lazy loading changed the load() arguments.',
+                )
+                settings.load()
+                self.assertDictEqual(
+                    self.rawdict, settings.data,
+                    msg='Failed to load again after lazy loading.'
                 )
-            else:
-                modified[k] = v
-        return modified
 
+        # Decoding errors should never leave empty settings behind.
+        fname = self.make_temp_filename()
+        with open(fname, 'w') as f:
+            f.write('{"x": 1, "bad": }')
+        settings = JSONSettings.from_file(fname, lazy=True)
+        for _ in range(2):
+            with self.assertRaises(ValueError, msg='Didn\'t raise!'):
+                settings.data
+        with self.assertRaises(ValueError, msg='Didn\'t raise on save!'):
+            settings.save(force=True)
+        with open(fname, 'r') as f:
+            self.assertEqual(
+                f.read(),
+                '{"x": 1, "bad": }',
+                msg='Saved over a file that failed to decode.',
+            )
 
-class CustomEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, CustomString):
-            items = [x.strip()[1:-1] for x in o.data.split(',')]
-            return items
-        return super(CustomEncoder, self).default(o)
+    def test_non_json_values(self):
+        """ JSONSettings should save and load values like json does. """
+        fname = self.make_temp_filename()
+        settings = JSONSettings(
+            {'nan': float('nan'), 'inf': float('inf'), 'ok': 1.5},
+            filename=fname,
+        )
+        settings.save()
+        loaded = JSONSettings.from_file(fname, use_cache=False)
+        self.assertTrue(
+            math.isnan(loaded['nan']),
+            msg='Failed to save/load NaN.',
+        )
+        self.assertEqual(loaded['inf'], float('inf'), msg='Failed on inf.')
+        self.assertEqual(loaded['ok'], 1.5, msg='Failed on a float.')
 
+        with open(fname, 'r') as f:
+            self.assertEqual(
+                f.read(),
+                json.dumps(settings.data, indent=4),
+                msg='Saved differently than json.',
+            )
 
-class CustomString(object):
-    def __init__(self, data):
-        self.data = str(data)
+        for value in (date(2018, 1, 2), pathlib.Path('test'), {1, 2}):
+            settings = JSONSettings({'value': value}, filename=fname)
+            with self.subTest(value=value):
+                with self.assertRaises(TypeError, msg='Didn\'t raise!'):
+                    settings.save()
 
-    def __eq__(self, other):
-        return isinstance(other, CustomString) and (self.data == other.data)
+    def test_save_replace(self):
+        """ JSONSettings should save through a temporary file. """
+        fname = self.make_temp_filename()
+        settings = JSONSettings(self.rawdict, filename=fname)
+        settings.save()
+        settings['new_key'] = 'new_value'
+        settings.save()
+        self.assertNoTempFiles()
+        self.assertDictEqual(
+            settings.data,
+            JSONSettings.from_file(fname).data,
+            msg='Failed to replace the saved file.',
+        )
+
+
+class TOMLSettingsBaseTests(SettingsBaseTests):
+    def test_get_lazy(self):
+        """ TOMLSettings.get_lazy() should read single keys from a file. """
+        fname = self.make_temp_filename()
+        with open(fname, 'w') as f:
+            f.write('\n'.join((
+                'name = "value"  # comment',
+                'multiline = [',
+                '    1, 2]',
+                '[table]',
+                'name = "inner"',
+            )))
+        settings = TOMLSettings(filename=fname)
+        self.assertEqual(
+            settings.get_lazy('name'),
+            'value',
+            msg='Failed to get a simple value.',
+        )
+        self.assertListEqual(
+            settings.get_lazy('multiline'),
+            [1, 2],
+            msg='Failed to fall back for a multi-line value.',
+        )
+        self.assertDictEqual(
+            settings.get_lazy('table'),
+            {'name': 'inner'},
+            msg='Failed to fall back for a table.',
+        )
+        self.assertIsNone(
+            settings.get_lazy('missing', None),
+            msg='Failed to return the default for a missing key.',
+        )
+        with self.assertRaises(KeyError, msg='Didn\'t raise on missing key!'):
+            settings.get_lazy('missing')
+
+        with open(fname, 'w') as f:
+            f.write('\n'.join((
+                'name = "value"',
+                '  [table]',
+                '  name = "inner"',
+                '\t[[items]]',
+                '\tother = "item"',
+            )))
+        self.assertEqual(
+            settings.get_lazy('name'),
+            'value',
+            msg='Failed to get a value before an indented table.',
+        )
+        with self.assertRaises(KeyError, msg='Found a key in a table!'):
+            settings.get_lazy('other')
+
+    def test_load_flat(self):
+        """ TOMLSettings should load flat and nested files the same way. """
+        fname = self.make_temp_filename()
+        for content, expected in (
+            (
+                'a = "x"  # comment\r\n\n# comment\n  b = \'c:\\d\'\n',
+                {'a': 'x', 'b': 'c:\\d'},
+            ),
+            ('a = "x\\ty"\nb = 1\n', {'a': 'x\ty', 'b': 1}),
+            ('a = "x"\n[t]\nb = "y"\n', {'a': 'x', 't': {'b': 'y'}}),
+            ('', {}),
+        ):
+            with self.subTest(content=content):
+                with open(fname, 'w', newline='') as f:
+                    f.write(content)
+                settings = TOMLSettings.from_file(fname, use_cache=False)
+                self.assertDictEqual(
+                    settings.data,
+                    expected,
+                    msg='Failed to load the file.',
+                )
+
+        with open(fname, 'w') as f:
+            f.write('a = "1"\na = "2"\n')
+        with self.assertRaises(
+                ValueError,
+                msg='Didn\'t raise for a duplicate key!'):
+            TOMLSettings.from_file(fname, use_cache=False)
+
+
+class YAMLSettingsBaseTests(SettingsBaseTests):
+    def test_get_lazy(self):
+        """ YAMLSettings.get_lazy() should read single keys from a file. """
+        fname = self.make_temp_filename()
+        with open(fname, 'w') as f:
+            f.write('\n'.join((
+                'skipped: {a: [1, {b: 2}], c: 3}',
+                'name: value',
+                'number: 1',
+                'list: [1, 2]',
+                'alias: &x 1',
+                'merged:',
+                '  <<: {name: inner}',
+            )))
+        settings = YAMLSettings(filename=fname)
+        for key, expected in (
+            ('name', 'value'),
+            ('number', 1),
+            ('list', [1, 2]),
+            ('alias', 1),
+            ('merged', {'name': 'inner'}),
+        ):
+            with self.subTest(key=key):
+                self.assertEqual(
+                    settings.get_lazy(key),
+                    expected,
+                    msg='Failed to get a value.',
+                )
+        self.assertIsNone(
+            settings.get_lazy('missing', None),
+            msg='Failed to return the default for a missing key.',
+        )
+        with self.assertRaises(KeyError, msg='Didn\'t raise on missing key!'):
+            settings.get_lazy('missing')
+
+        for content in (
+            'name: first\nother: 1\nname: last\n',
+            'name: [first]\nname: last\n',
+            'name: first\nname: [last]\n',
+        ):
+            with self.subTest(content=content):
+                with open(fname, 'w') as f:
+                    f.write(content)
+                self.assertEqual(
+                    settings.get_lazy('name'),
+                    YAMLSettings.from_file(fname, use_cache=False)['name'],
+                    msg='Didn\'t use the last duplicate key, like load().',
+                )
+
+    def test_load_flat(self):
+        """ YAMLSettings should load flat and nested files the same way. """
+        fname = self.make_temp_filename()
+        for content, expected in (
+            (
+                'a: 1\nb: true\nc: 1.5\nd: null\ne: text\n"1": \'2\'\n',
+                {
+                    'a': 1, 'b': True, 'c': 1.5, 'd': None, 'e': 'text',
+                    '1': '2',
+                },
+            ),
+            ('a: 1\nb: [1, 2]\n', {'a': 1, 'b': [1, 2]}),
+            ('a: &x 1\nb: *x\n', {'a': 1, 'b': 1}),
+            ('a: !!python/tuple [1, 2]\n', {'a': (1, 2)}),
+            (
+                '1: one\n2018-01-02: date\n',
+                {1: 'one', date(2018, 1, 2): 'date'},
+            ),
+            ('', {}),
+        ):
+            with self.subTest(content=content):
+                with open(fname, 'w') as f:
+                    f.write(content)
+                settings = YAMLSettings.from_file(fname, use_cache=False)
+                self.assertDictEqual(
+                    settings.data,
+                    expected,
+                    msg='Failed to load the file.',
+                )
+
+        with open(fname, 'w') as f:
+            f.write('a: 1\n---\nb: 2\n')
+        with self.assertRaises(
+                yaml.YAMLError,
+                msg='Didn\'t raise for more than one document!'):
+            YAMLSettings.from_file(fname, use_cache=False)
 
 
+@functools.lru_cache(maxsize=None)
 def create_settings_hook(cls):
     """ Create a *Settings_Hook class to use with tests.
         It will have the proper name, dynamically created.
@@ -563,61 +1269,28 @@ def create_settings_hook(cls):
     )
 
 
-def create_suite(module, settings_cls, load_func, extension=None, bases=None):
-    """ Create a test suite class for any subclass of SettingsBase. """
-    testname = '{}Tests'.format(settings_cls.__name__)
-
-    def cls_load_func(self, *args, **kwargs):
-        return load_func(*args, **kwargs)
-
-    bases = list(bases or [])
-    for userbase in bases:
-        if isinstance(userbase, SettingsBaseTests):
-            break
-    else:
-        bases.append(SettingsBaseTests)
-    bases.append(unittest.TestCase)
-
-    return type(
-        testname,
-        tuple(bases),
-        {
-            'module': module,
-            'extension': extension or '',
-            'settings_cls': settings_cls,
-            'load_func': cls_load_func,
-        }
-    )
-
-
 # Tests for SettingsBase subclasses.
-JSONSettingsTests = create_suite(
-    json,
-    JSONSettings,
-    load_json_settings,
-    extension='.json',
-    bases=(JSONSettingsBaseTests, ),
-)
-
-TOMLSettingsTests = unittest.skipIf(
-    toml is None,
-    "toml is not available"
-)(create_suite(
-    toml,
-    TOMLSettings,
-    load_toml_settings,
-    extension='.toml',
-))
-
-YAMLSettingsTests = unittest.skipIf(
-    yaml is None,
-    "yaml is not available"
-)(create_suite(
-    yaml,
-    YAMLSettings,
-    load_yaml_settings,
-    extension='.yaml',
-))
+class JSONSettingsTests(JSONSettingsBaseTests, unittest.TestCase):
+    module = json
+    extension = '.json'
+    settings_cls = JSONSettings
+    load_func = staticmethod(load_json_settings)
+
+
+@unittest.skipIf(toml is None, 'toml is not available')
+class TOMLSettingsTests(TOMLSettingsBaseTests, unittest.TestCase):
+    module = toml
+    extension = '.toml'
+    settings_cls = TOMLSettings
+    load_func = staticmethod(load_toml_settings)
+
+
+@unittest.skipIf(yaml is None, 'yaml is not available')
+class YAMLSettingsTests(YAMLSettingsBaseTests, unittest.TestCase):
+    module = yaml
+    extension = '.yaml'
+    settings_cls = YAMLSettings
+    load_func = staticmethod(load_yaml_settings)
 
 
 if __name__ == '__main__':
@@ -5,23 +5,74 @@
     * Must have the `toml` package installed (from pip). Not `pytoml`!.
     Christopher Welborn 05-07-19
 """
+import mmap
+import os
+import re
 try:
     import toml
 except ImportError:
     # Raise when used, not while importing. This module may not even be used.
     toml = None
 
+try:
+    # Python 3.11+, a faster (read-only) parser.
+    import tomllib as toml_reader
+except ImportError:
+    try:
+        import tomli as toml_reader
+    except ImportError:
+        # toml.load() will be used.
+        toml_reader = None
+
 from .common_base import (
+    NotSet,
     SettingsBase,
     load_settings,
 )
 
 __all__ = ['TOMLSettings', 'load_toml_settings']
 
+# A line in a flat TOML file: `key = "string"`, a comment, or nothing.
+# Strings with escapes, and anything else, are left for the real parser.
+_FLAT_LINE_RE = re.compile(
+    br'[ \t]*(?:'
+    br'([A-Za-z0-9_-]+)[ \t]*=[ \t]*'
+    br'(?:"([^"\\\x00-\x08\x0a-\x1f\x7f]*)"|'
+    br"'([^'\x00-\x08\x0a-\x1f\x7f]*)')"
+    br'[ \t]*)?(?:#[^\n]*)?\r?'
+)
+# The start of a [table] or [[array]] header, which may be indented.
+_TABLE_RE = re.compile(br'^[ \t]*\[', flags=re.MULTILINE)
+
 
-def default_translate(strtype, strvalue, value):
-    """ Default `translate` function for pytoml. """
-    return value
+def _load_flat(raw):
+    """ Decode raw TOML bytes that only hold top-level `key = "string"`
+        lines (and comments), without the full parser.
+        Returns None if there is anything else in it.
+    """
+    if raw.endswith(b'\r'):
+        # Not a line ending without the \n.
+        return None
+    data = {}
+    count = 0
+    for line in raw.split(b'\n'):
+        match = _FLAT_LINE_RE.fullmatch(line)
+        if match is None:
+            return None
+        key, value, literal = match.groups()
+        if key is None:
+            continue
+        if value is None:
+            value = literal
+        data[key.decode('ascii')] = value
+        count += 1
+    if len(data) != count:
+        # Duplicate keys, let the parser complain about it.
+        return None
+    try:
+        return {k: v.decode('utf-8') for k, v in data.items()}
+    except UnicodeDecodeError:
+        return None
 
 
 def load_toml_settings(
@@ -63,13 +114,15 @@ class TOMLSettings(SettingsBase):
     """
     def __init__(
             self, iterable=None, filename=None,
-            _dict=dict,
+            _dict=dict, sidecar=False,
             **kwargs):
-        """ Initialize a TOMLSettings instance like a `dict`, with optional
-            `translate` and `object_pairs_hook` arguments for pytoml.
+        """ Initialize a TOMLSettings instance like a `dict`, with an optional
+            `_dict` argument (the mapping class used by toml.load()).
+            If `sidecar` is True, a pickled copy of the decoded file is kept
+            next to it, and used while the file is unchanged.
         """
         if toml is None:
-            # pytoml was not imported, and you are trying to use this class.
+            # toml was not imported, and you are trying to use this class.
             raise ImportError(
                 'toml could not be imported. Install it with `pip`?'
             )
@@ -79,6 +132,9 @@ class TOMLSettings(SettingsBase):
             **kwargs
         )
         self._dict = _dict
+        if sidecar:
+            # Otherwise, the class default is used.
+            self.sidecar = sidecar
 
     @classmethod
     def from_file(cls, filename, _dict=dict, **kwargs):
@@ -92,18 +148,111 @@ class TOMLSettings(SettingsBase):
         settings.load(**kwargs)
         return settings
 
+    def _read_file(self, module, **kwargs):
+        """ Read and decode self.filename, using tomllib/tomli when
+            available and no custom `_dict` or extra toml.load() arguments
+            are used. Flat files of string values skip the parser.
+        """
+        extra_args = dict(kwargs)
+        _dict = extra_args.pop('_dict', dict)
+        if (_dict is not dict) or extra_args:
+            return super(TOMLSettings, self)._read_file(module, **kwargs)
+        with open(self.filename, 'rb') as f:
+            raw = f.read()
+        data = _load_flat(raw)
+        if data is not None:
+            return data
+        if toml_reader is None:
+            return module.loads(raw.decode('utf-8'))
+        return toml_reader.loads(raw.decode('utf-8'))
+
+    def _dump_items(self, items):
+        """ Encode new top-level `items` as `key = value` lines, which can be
+            appended to a flat TOML file.
+        """
+        if not all(isinstance(k, str) and (v is not None)
+                   for k, v in items.items()):
+            # TOML has no null, and only string keys.
+            return None
+        return toml.dumps(items).encode('utf-8')
+
+    def _find_key(self, key):
+        """ Find and decode a single top-level `key` in self.filename,
+            without parsing the rest of the file.
+            Returns NotSet if the key can't be found this way.
+        """
+        with open(self.filename, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return NotSet
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                # Top-level keys come before the first [table].
+                # (a line in a multi-line array may also match, which only
+                #  stops the search early)
+                table = _TABLE_RE.search(mapped)
+                end = len(mapped) if table is None else table.start()
+                pattern = re.compile(
+                    br'^[ \t]*' + re.escape(key.encode()) + br'[ \t]*=',
+                    flags=re.MULTILINE,
+                )
+                match = pattern.search(mapped, 0, end)
+                if match is None:
+                    return NotSet
+                start = match.start()
+                if (mapped.find(b'"""', 0, start) != -1) or (
+                        mapped.find(b"'''", 0, start) != -1):
+                    # Might be inside a multi-line string.
+                    return NotSet
+                eol = mapped.find(b'\n', start, end)
+                line = mapped[start:end if eol == -1 else eol]
+        try:
+            return toml_reader.loads(line.decode('utf-8'))[key]
+        except (ValueError, KeyError):
+            # Multi-line value, or something else this can't handle.
+            # (TOMLDecodeError and UnicodeDecodeError are ValueErrors)
+            return NotSet
+
+    def get_lazy(self, key, default=NotSet):
+        """ Like get(), but reads a single top-level key straight from
+            self.filename, without loading or parsing the whole file.
+            Only simple one-line values are parsed this way, anything else
+            falls back to loading the whole file.
+            This requires tomllib (Python 3.11+) or tomli.
+        """
+        if not self.filename:
+            raise ValueError('`filename` must be set.')
+        if (toml_reader is not None) and isinstance(key, str):
+            value = self._find_key(key)
+            if value is not NotSet:
+                return value
+        return type(self).from_file(
+            self.filename,
+            _dict=self._dict,
+        ).get(key, default)
+
     def load(self, filename=None, **kwargs):
         """ Load this dict from a TOML file.
-            Raises the same errors as open() and toml.load().
+            Raises the same errors as open() and toml.load()
+            (or tomllib.load(), when it is used).
         """
-        super(TOMLSettings, self).load(toml, _dict=self._dict, **kwargs)
+        super(TOMLSettings, self).load(
+            toml,
+            filename=filename,
+            _dict=self._dict,
+            **kwargs
+        )
 
-    def save(self, filename=None):
+    def save(self, filename=None, force=False):
         """ Save this dict to a TOML file.
             Raises the same errors as open() and toml.dump().
+            Nothing is written if nothing changed since the file was loaded
+            or saved, unless `force` is True.
         """
-        super(TOMLSettings, self).save(toml, filename=filename)
+        super(TOMLSettings, self).save(
+            toml,
+            filename=filename,
+            force=force,
+        )
 
     def setsave(self, option, value, filename=None):
         """ The same as calling .set() and then .save(). """
-        super(TOMLSettings, self).setsave(filename=filename)
+        super(TOMLSettings, self).setsave(option, value, filename=filename)
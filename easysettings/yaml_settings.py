@@ -4,19 +4,191 @@
     ...Simple YAML settings class.
     Christopher Welborn 05-07-19
 """
-try:
-    import yaml
-except ImportError:
-    # Raise when used, not while importing. This module may not even be used.
-    yaml = None
+import warnings
 
 from .common_base import (
     load_settings,
+    NotSet,
     SettingsBase,
+    write_replace,
 )
 
 __all__ = ['YAMLSettings', 'load_yaml_settings']
 
+# pyyaml is imported on first use, see _get_yaml().
+# This module may not even be used, and pyyaml is slow to import.
+yaml = NotSet
+# Best Loader/Dumper classes, set by _get_yaml().
+YAML_LOADER = YAML_DUMPER = None
+
+# Whether the missing LibYAML warning was already shown, see YAMLSettings().
+_warned_libyaml = False
+
+# Resolved scalar tags that _load_flat() handles without building nodes.
+YAML_STR_TAG = 'tag:yaml.org,2002:str'
+# Resolved scalar tags that only mean something inside a mapping node.
+YAML_MAPPING_TAGS = ('tag:yaml.org,2002:merge', 'tag:yaml.org,2002:value')
+
+
+def _get_yaml():
+    """ Returns the `yaml` module, importing it on first use, and sets
+        YAML_LOADER/YAML_DUMPER.
+        Returns None if pyyaml is not installed.
+    """
+    global yaml, YAML_LOADER, YAML_DUMPER
+    if yaml is NotSet:
+        try:
+            import yaml as yaml_module
+        except ImportError:
+            yaml = None
+            return None
+        # The LibYAML C bindings are much faster, when pyyaml was built with
+        # them. Full loader, not safe, because the default dumper writes
+        # python tags (like !!python/tuple) that the safe loader refuses to
+        # load.
+        YAML_LOADER = getattr(
+            yaml_module,
+            'CFullLoader',
+            # pyyaml < 5.1 has no FullLoader, and its Loader is the default.
+            getattr(yaml_module, 'FullLoader', yaml_module.Loader),
+        )
+        YAML_DUMPER = getattr(yaml_module, 'CDumper', yaml_module.Dumper)
+        yaml = yaml_module
+    return yaml
+
+
+def _load_flat(stream, loader_cls):
+    """ Decode a YAML document that is a single mapping of scalars straight
+        from the parser's events, without composing a node tree first.
+        Returns None if the document is anything else (nested values,
+        aliases, tags on the mapping, more than one document), so the caller
+        can load it the normal way.
+    """
+    loader = loader_cls(stream)
+    try:
+        get_event = loader.get_event
+        get_event()  # StreamStartEvent
+        if not loader.check_event(yaml.DocumentStartEvent):
+            # Empty stream.
+            return None
+        get_event()
+        event = get_event()
+        if (type(event) is not yaml.MappingStartEvent) or (
+                event.tag is not None) or (event.anchor is not None):
+            return None
+        resolve = loader.resolve
+        construct = loader.construct_object
+        items = []
+        while True:
+            event = get_event()
+            if type(event) is not yaml.ScalarEvent:
+                if type(event) is yaml.MappingEndEvent:
+                    break
+                # Nested value, or an alias.
+                return None
+            if event.anchor is not None:
+                return None
+            tag = event.tag
+            value = event.value
+            if (tag is None) or (tag == '!'):
+                tag = resolve(yaml.ScalarNode, value, event.implicit)
+            if tag == YAML_STR_TAG:
+                items.append(value)
+            elif tag in YAML_MAPPING_TAGS:
+                return None
+            else:
+                items.append(
+                    construct(yaml.ScalarNode(tag, value, style=event.style))
+                )
+        if not loader.check_event(yaml.DocumentEndEvent):
+            return None
+        get_event()
+        if not loader.check_event(yaml.StreamEndEvent):
+            # More than one document, let yaml.load() complain about it.
+            return None
+    finally:
+        loader.dispose()
+    pairs = iter(items)
+    return dict(zip(pairs, pairs))
+
+
+def _find_key(stream, loader_cls, key):
+    """ Find and decode a single top-level string `key` in a YAML document
+        from the parser's events, without building the node tree.
+        Like yaml.load(), the last of any duplicate keys is used.
+        Returns NotSet if the key can't be found this way (missing, or not
+        a plain scalar value, or not a single mapping document).
+    """
+    loader = loader_cls(stream)
+    try:
+        get_event = loader.get_event
+        get_event()  # StreamStartEvent
+        if not loader.check_event(yaml.DocumentStartEvent):
+            # Empty stream.
+            return NotSet
+        get_event()
+        event = get_event()
+        if (type(event) is not yaml.MappingStartEvent) or (
+                event.tag is not None) or (event.anchor is not None):
+            return NotSet
+        nested = (yaml.MappingStartEvent, yaml.SequenceStartEvent)
+        nested_end = (yaml.MappingEndEvent, yaml.SequenceEndEvent)
+        value = NotSet
+        while True:
+            event = get_event()
+            if type(event) is yaml.MappingEndEvent:
+                break
+            if type(event) is not yaml.ScalarEvent:
+                # A complex key.
+                return NotSet
+            found = event.value == key
+            if found:
+                tag = event.tag
+                if (tag is None) or (tag == '!'):
+                    tag = loader.resolve(
+                        yaml.ScalarNode,
+                        event.value,
+                        event.implicit,
+                    )
+                found = tag == YAML_STR_TAG
+            event = get_event()
+            if found:
+                # Any earlier value for this key is replaced.
+                value = NotSet
+                if (type(event) is yaml.ScalarEvent) and (
+                        event.anchor is None):
+                    tag = event.tag
+                    if (tag is None) or (tag == '!'):
+                        tag = loader.resolve(
+                            yaml.ScalarNode,
+                            event.value,
+                            event.implicit,
+                        )
+                    if tag not in YAML_MAPPING_TAGS:
+                        value = loader.construct_object(
+                            yaml.ScalarNode(
+                                tag,
+                                event.value,
+                                style=event.style,
+                            )
+                        )
+            if isinstance(event, nested):
+                # Skip the whole value.
+                depth = 1
+                while depth:
+                    event = get_event()
+                    if isinstance(event, nested):
+                        depth += 1
+                    elif isinstance(event, nested_end):
+                        depth -= 1
+        get_event()  # DocumentEndEvent
+        if not loader.check_event(yaml.StreamEndEvent):
+            # More than one document, yaml.load() will complain.
+            return NotSet
+        return value
+    finally:
+        loader.dispose()
+
 
 def load_yaml_settings(filename, default=None, cls=None, **kwargs):
     """ Tries to create a YAMLSettings from a filename, but returns a new
@@ -52,22 +224,40 @@ class YAMLSettings(SettingsBase):
     """
     def __init__(
             self, iterable=None, filename=None,
-            _dict=dict,
+            _dict=dict, sidecar=False,
             **kwargs):
-        """ Initialize a YAMLSettings instance like a `dict`, with optional
-            `translate` and `object_pairs_hook` arguments for pyyaml.
+        """ Initialize a YAMLSettings instance like a `dict`.
+            If `sidecar` is True, a pickled copy of the decoded file is kept
+            next to it, and used while the file is unchanged.
+            `_dict` is accepted for backwards compatibility, and ignored.
         """
-        if yaml is None:
-            # pyyaml was not imported, and you are trying to use this class.
+        if _get_yaml() is None:
+            # pyyaml can't be imported, and you are trying to use this class.
             raise ImportError(
                 'pyyaml could not be imported. Install it with `pip`?'
             )
+        global _warned_libyaml
+        if not (_warned_libyaml or hasattr(yaml, 'CLoader')):
+            # Warned here, not on import, because most users of
+            # easysettings never use YAMLSettings.
+            _warned_libyaml = True
+            warnings.warn(
+                ' '.join((
+                    'pyyaml was built without LibYAML,',
+                    'so YAMLSettings will load/save about 10x slower.',
+                    'Reinstall pyyaml with the libyaml headers available?',
+                )),
+                RuntimeWarning,
+                stacklevel=2,
+            )
         super(YAMLSettings, self).__init__(
             iterable=iterable,
             filename=filename,
             **kwargs
         )
-        self._dict = _dict
+        if sidecar:
+            # Otherwise, the class default is used.
+            self.sidecar = sidecar
 
     @classmethod
     def from_file(cls, filename, **kwargs):
@@ -81,24 +271,94 @@ class YAMLSettings(SettingsBase):
         settings.load(**kwargs)
         return settings
 
-    def load(self, filename=None, **kwargs):
+    def _dump_items(self, items):
+        """ Encode new top-level `items` as block mapping lines, which can be
+            appended to a YAML file written by save().
+        """
+        if (not self.data) or (self._saved[3] is None):
+            # An empty mapping is written as `{}`, and a loaded file may use
+            # any style.
+            return None
+        # The same yaml.dump() arguments that save() used.
+        return yaml.dump(items, encoding='utf-8', **self._saved[3])
+
+    def _find_key(self, key):
+        """ Find and decode a single top-level `key` in self.filename,
+            without parsing the rest of the file.
+            Returns NotSet if the key can't be found this way.
+        """
+        with open(self.filename, 'rb') as f:
+            return _find_key(f, YAML_LOADER, key)
+
+    def get_lazy(self, key, default=NotSet):
+        """ Like get(), but reads a single top-level key straight from
+            self.filename, from the parser's events, without building the
+            whole document.
+            Only scalar values are read this way, anything else falls back
+            to loading the whole file.
+        """
+        if not self.filename:
+            raise ValueError('`filename` must be set.')
+        if (YAML_LOADER is not None) and isinstance(key, str):
+            value = self._find_key(key)
+            if value is not NotSet:
+                return value
+        return type(self).from_file(self.filename).get(key, default)
+
+    def _read_file(self, module, **kwargs):
+        """ Read and decode self.filename using yaml.load(f, **kwargs).
+            The file is opened in binary mode, so the YAML parser reads
+            and decodes it in chunks itself (YAML is always UTF-8/16/32).
+        """
+        with open(self.filename, 'rb') as f:
+            if (kwargs == {'Loader': YAML_LOADER}) and (
+                    YAML_LOADER is not None):
+                # Flat files (the common case) are decoded from the parser
+                # events, skipping the node tree.
+                data = _load_flat(f, YAML_LOADER)
+                if data is not None:
+                    return data
+                f.seek(0)
+            return module.load(f, **kwargs)
+
+    def _write_file(self, module, data, **kwargs):
+        """ Encode `data` as UTF-8 YAML with yaml.dump(data, **kwargs), and
+            write it to self.filename in one go (see write_replace()).
+        """
+        # Encoded before opening the file, so it isn't touched on errors.
+        payload = module.dump(data, encoding='utf-8', **kwargs)
+        write_replace(self.filename, payload, durable=self.durable)
+
+    def load(self, filename=None, Loader=None, **kwargs):
         """ Load this dict from a YAML file.
             Raises the same errors as open() and yaml.load().
+            Arguments:
+                filename  : File name to read. Default: self.filename
+                Loader    : pyyaml Loader class. Default: YAML_LOADER
         """
-        if kwargs.get('Loader', None) is None:
-            # Try using default/safe loader since the user didn't specify.
-            # Otherwise, you get a warning.
-            full_loader = getattr(yaml, 'FullLoader', None)
-            if full_loader is not None:
-                kwargs['Loader'] = full_loader
-        super(YAMLSettings, self).load(yaml, filename=filename, **kwargs)
-
-    def save(self, filename=None):
+        super(YAMLSettings, self).load(
+            yaml,
+            filename=filename,
+            Loader=Loader or YAML_LOADER,
+            **kwargs
+        )
+
+    def save(self, filename=None, force=False):
         """ Save this dict to a YAML file.
             Raises the same errors as open() and yaml.dump().
+            Nothing is written if nothing changed since the file was loaded
+            or saved, unless `force` is True.
         """
-        super(YAMLSettings, self).save(yaml, filename=filename)
+        super(YAMLSettings, self).save(
+            yaml,
+            filename=filename,
+            force=force,
+            Dumper=YAML_DUMPER,
+            default_flow_style=False,
+            # Written as UTF-8 text, instead of escape sequences.
+            allow_unicode=True,
+        )
 
     def setsave(self, option, value, filename=None):
         """ The same as calling .set() and then .save(). """
-        super(YAMLSettings, self).setsave(filename=filename)
+        super(YAMLSettings, self).setsave(option, value, filename=filename)
@@ -5,25 +5,19 @@ EasySettings Setup
 @author: Christopher Welborn
 '''
 
+import io
+
 from setuptools import setup
 defaultdesc = 'Easily set and retrieve application settings.'
+
+# PyPI renders markdown, so README.md is used as-is. There is no pandoc
+# conversion step, which isolated (pyproject.toml) builds couldn't run.
 try:
-    import pypandoc
-except ImportError:
-    print('Pypandoc not installed, using default description.')
+    with io.open('README.md', encoding='utf-8') as f:
+        longdesc = f.read()
+except EnvironmentError:
+    print('\nREADME.md failed!')
     longdesc = defaultdesc
-else:
-    # Convert using pypandoc.
-    try:
-        longdesc = pypandoc.convert('README.md', 'rst')
-    except EnvironmentError:
-        # Fallback to README.txt (may be behind on updates.)
-        try:
-            with open('README.txt') as f:
-                longdesc = f.read()
-        except EnvironmentError:
-            print('\nREADME.md and README.txt failed!')
-            longdesc = defaultdesc
 
 
 setup(
@@ -36,6 +30,7 @@ setup(
     license='LICENSE.txt',
     description=open('DESC.txt').read(),
     long_description=longdesc,
+    long_description_content_type='text/markdown',
     keywords=' '.join((
         'python module library 3 settings easy',
         'config setting configuration applications app',
@@ -51,7 +46,14 @@ setup(
     ],
     python_requires='~=3.5',
     extras_require={
-        'all': ['pyyaml >= 3.12', 'toml >= 0.10.0'],
+        # orjson needs Python 3.6+.
+        'all': [
+            'orjson >= 3.0.0; python_version >= "3.6"',
+            'pyyaml >= 3.12',
+            'toml >= 0.10.0',
+        ],
+        'json': ['orjson >= 3.0.0; python_version >= "3.6"'],
+        'simdjson': ['pysimdjson >= 3.0.0'],
         'yaml': ['pyyaml >= 3.12'],
         'toml': ['toml >= 0.10.0'],
     },